@@ -0,0 +1,302 @@
+"""Offline end-to-end benchmark for the posting pipeline and the webhook.
+
+Starts local stand-ins for the Telegram Bot API, the OpenAI chat completions
+API and a set of RSS feeds with their article pages, points the bot at them and reports posts/min,
+webhook latency, SQLite statements per cycle and memory use.
+
+    python benchmarks/bench_e2e.py --channels 50 --cycles 30
+    python benchmarks/bench_e2e.py --llm-latency 0.8 --llm-error-rate 0.1 --output bench_output.txt
+
+Recorded feeds can be replayed with ``--feeds-dir`` (every ``*.xml`` file is
+served as one source); otherwise synthetic feeds are generated.
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, handler, **options):
+        super().__init__(("127.0.0.1", 0), handler)
+        self.options = options
+        self.requests = 0
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status, body, content_type="application/json"):
+        data = body if isinstance(body, bytes) else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+
+class TelegramHandler(StubHandler):
+    """Bot API stub: getMe, getChatMember, sendMessage, sendDocument."""
+
+    def handle_method(self):
+        self.read_body()
+        self.server.requests += 1
+        options = self.server.options
+        method = self.path.split("?")[0].rsplit("/", 1)[-1]
+        time.sleep(options["latency"])
+        if method == "getMe":
+            self.send_body(200, {"ok": True, "result": {"id": 1, "is_bot": True}})
+        elif method == "getChatMember":
+            self.send_body(200, {"ok": True, "result": {"status": "administrator"}})
+        elif method in ("sendMessage", "sendDocument"):
+            if random.random() < options["rate_limit_rate"]:
+                self.send_body(429, {"ok": False, "error_code": 429, "parameters": {"retry_after": 0.05}})
+            else:
+                self.send_body(200, {"ok": True, "result": {"message_id": self.server.requests}})
+        else:
+            self.send_body(404, {"ok": False, "description": "Not Found"})
+
+    do_GET = handle_method
+    do_POST = handle_method
+
+
+class OpenAIHandler(StubHandler):
+    """OpenAI-compatible /v1/chat/completions stub with latency and error rate."""
+
+    def do_POST(self):
+        request = json.loads(self.read_body() or b"{}")
+        self.server.requests += 1
+        options = self.server.options
+        time.sleep(options["latency"])
+        if random.random() < options["error_rate"]:
+            self.send_body(500, {"error": {"message": "stub failure", "type": "server_error"}})
+            return
+        content = "Компания представила новое устройство\nОписание новости в одном предложении."
+        self.send_body(200, {
+            "id": f"chatcmpl-{self.server.requests}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "stub"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": 100, "completion_tokens": 30, "total_tokens": 130},
+        })
+
+
+class RSSHandler(StubHandler):
+    """Serves ``/feed/<n>.xml`` from recorded files or synthetic documents,
+    and ``/article/...`` pages for the synthetic entries."""
+
+    def do_GET(self):
+        self.server.requests += 1
+        if self.path.startswith("/article/"):
+            self.send_body(200, synthetic_article(self.path), "text/html; charset=utf-8")
+            return
+        feeds = self.server.options["feeds"]
+        name = self.path.rsplit("/", 1)[-1]
+        if name not in feeds:
+            self.send_body(404, b"not found", "text/plain")
+            return
+        self.send_body(200, feeds[name], "application/rss+xml")
+
+
+def synthetic_feed(base_url, index, items):
+    now = time.time()
+    entries = "".join(
+        f"<item><title>Source {index} story {i}</title>"
+        f"<link>{base_url}/article/{index}/{i}</link>"
+        f"<guid>{base_url}/article/{index}/{i}</guid>"
+        f"<pubDate>{formatdate(now - i * 600, usegmt=True)}</pubDate>"
+        f"<description>Synthetic article {i} from source {index}.</description></item>"
+        for i in range(items)
+    )
+    return (
+        f'<?xml version="1.0"?><rss version="2.0"><channel><title>Source {index}</title>'
+        f"<link>https://news{index}.example.com/</link>{entries}</channel></rss>"
+    ).encode()
+
+
+def synthetic_article(path):
+    paragraphs = "".join(
+        f"<p>Paragraph {i} of the story at {path} with enough words to count as article text.</p>"
+        for i in range(40)
+    )
+    return (
+        f"<html><body><nav><a href='/'>Home</a></nav><article><h1>Story {path}</h1>{paragraphs}</article>"
+        f"<footer><p>Copyright Example Media, all rights reserved.</p></footer></body></html>"
+    ).encode()
+
+
+def load_feeds(args, base_url):
+    if args.feeds_dir:
+        paths = sorted(Path(args.feeds_dir).glob("*.xml"))
+        return {f"{i}.xml": path.read_bytes() for i, path in enumerate(paths)}
+    return {f"{i}.xml": synthetic_feed(base_url, i, args.items) for i in range(args.feeds)}
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def run(args):
+    random.seed(args.seed)
+    telegram = StubServer(TelegramHandler, latency=args.tg_latency, rate_limit_rate=args.tg_429_rate)
+    openai_stub = StubServer(OpenAIHandler, latency=args.llm_latency, error_rate=args.llm_error_rate)
+    rss = StubServer(RSSHandler, feeds={})
+    rss.options["feeds"] = load_feeds(args, rss.url)
+    workdir = tempfile.mkdtemp(prefix="autonews-bench-")
+
+    # The modules read their configuration at import time.
+    os.environ.update({
+        "TELEGRAM_TOKEN": "bench",
+        "TELEGRAM_API_URL": telegram.url,
+        "OPENAI_API_KEY": "bench",
+        "OPENAI_BASE_URL": f"{openai_stub.url}/v1",
+        "LLM_RPM": str(args.llm_rpm),
+        "LLM_TPM": str(args.llm_rpm * 10000),
+        "TELEGRAM_GLOBAL_RATE": str(args.tg_rate),
+        "TELEGRAM_CHAT_RATE": str(args.tg_rate),
+    })
+    import logging
+    logging.disable(logging.CRITICAL)
+
+    import database as db
+    db.DB_FILE = os.path.join(workdir, "feedcache.db")
+    import feeds
+    feeds.RSS_URLS = [f"{rss.url}/feed/{name}" for name in sorted(rss.options["feeds"])]
+    feeds.PENDING_MAX_AGE = 365 * 24 * 3600
+    import bot
+
+    for i in range(args.channels):
+        db.save_channel(f"-100{i:06d}", f"admin{i}")
+        feeds.schedule_channel(f"-100{i:06d}")
+
+    tracemalloc.start()
+    sqlite_before = db.SQLITE_QUERY_SECONDS.count()
+
+    # Posting pipeline.
+    poll_start = time.perf_counter()
+    queued = feeds.poll_feeds()
+    poll_seconds = time.perf_counter() - poll_start
+    sqlite_after_poll = db.SQLITE_QUERY_SECONDS.count()
+    cycle_times = []
+    cycles_start = time.perf_counter()
+    for _ in range(args.cycles):
+        start = time.perf_counter()
+        feeds.run_posting_cycle()
+        cycle_times.append(time.perf_counter() - start)
+    cycles_seconds = time.perf_counter() - cycles_start
+    sqlite_after_cycles = db.SQLITE_QUERY_SECONDS.count()
+    news_posted = feeds.POSTS.value() / max(args.channels, 1)
+
+    # Webhook: enqueue latency as seen by Telegram plus end-to-end handling.
+    client = bot.app.test_client()
+    commands = ["/help", "/info", "/feedcache", "/errinf", "hello"]
+    ack_times = []
+    webhook_start = time.perf_counter()
+    for i in range(args.updates):
+        update = {
+            "update_id": i if random.random() > args.redelivery_rate else max(i - 1, 0),
+            "message": {
+                "message_id": i,
+                "chat": {"id": 1000 + i % 10, "type": "private"},
+                "from": {"username": f"admin{i % max(args.channels, 1)}"},
+                "text": commands[i % len(commands)],
+            },
+        }
+        start = time.perf_counter()
+        client.post("/webhook", json=update)
+        ack_times.append(time.perf_counter() - start)
+    bot.update_queue.join()
+    webhook_seconds = time.perf_counter() - webhook_start
+
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    report = [
+        "AutoNews offline benchmark",
+        f"feeds={len(feeds.RSS_URLS)} channels={args.channels} cycles={args.cycles} updates={args.updates}",
+        f"llm_latency={args.llm_latency}s llm_error_rate={args.llm_error_rate} tg_latency={args.tg_latency}s",
+        "",
+        f"poll: {queued} entries queued in {poll_seconds * 1000:.1f} ms",
+        f"posting: {news_posted:.0f} news x {args.channels} channels in {cycles_seconds:.2f} s",
+        f"posts/min (news): {news_posted / cycles_seconds * 60 if cycles_seconds else 0:.1f}",
+        f"posts/min (channel messages): {feeds.POSTS.value() / cycles_seconds * 60 if cycles_seconds else 0:.1f}",
+        f"cycle p50/p99: {percentile(cycle_times, 0.5) * 1000:.1f} / {percentile(cycle_times, 0.99) * 1000:.1f} ms",
+        f"webhook ack p50/p99: {percentile(ack_times, 0.5) * 1000:.2f} / {percentile(ack_times, 0.99) * 1000:.2f} ms",
+        f"webhook throughput: {args.updates / webhook_seconds if webhook_seconds else 0:.0f} updates/s (handled)",
+        f"sqlite statements: poll {sqlite_after_poll - sqlite_before}, "
+        f"per cycle {(sqlite_after_cycles - sqlite_after_poll) / max(args.cycles, 1):.1f}",
+        f"stub requests: telegram {telegram.requests}, openai {openai_stub.requests}, rss {rss.requests}",
+        f"memory: python peak {peak / 1024 / 1024:.1f} MiB, max RSS {rss_kb / 1024:.1f} MiB",
+    ]
+    if args.cycles and cycle_times:
+        report.append(f"cycle mean: {statistics.mean(cycle_times) * 1000:.1f} ms")
+    text = "\n".join(report)
+    print(text)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+    for server in (telegram, openai_stub, rss):
+        server.shutdown()
+    db.close_connection()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--feeds", type=int, default=10, help="synthetic feeds to serve")
+    parser.add_argument("--items", type=int, default=20, help="entries per synthetic feed")
+    parser.add_argument("--feeds-dir", help="directory with recorded *.xml feeds to replay")
+    parser.add_argument("--channels", type=int, default=20)
+    parser.add_argument("--cycles", type=int, default=20, help="posting cycles to run back to back")
+    parser.add_argument("--updates", type=int, default=500, help="webhook updates to send")
+    parser.add_argument("--redelivery-rate", type=float, default=0.05)
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--llm-rpm", type=int, default=100000)
+    parser.add_argument("--tg-latency", type=float, default=0.01)
+    parser.add_argument("--tg-429-rate", type=float, default=0.0)
+    parser.add_argument("--tg-rate", type=float, default=1000, help="Telegram messages/s, global and per chat")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="also write the report to this file")
+    run(parser.parse_args(argv))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,19 @@
 import json
 import logging
-import requests
-import sqlite3
-from flask import Flask, request
+import os
+import queue
+import tempfile
+import threading
+from collections import deque
+from datetime import datetime
+from functools import cached_property
+from flask import Flask, Response, request
 
 import database as db
 import feeds
+import llm
+import metrics
 import telegram_api as tg
-from llm import last_llm_response
 
 app = Flask(__name__)
 
@@ -15,6 +21,31 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 logger = logging.getLogger(__name__)
 
 db.init_db()
+feeds.init_feeds()
+
+# Updates are acknowledged at once and handled by a small worker pool, so a
+# slow command never holds up Telegram's webhook delivery.
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "4"))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "100"))
+update_queue = queue.Queue(maxsize=WEBHOOK_QUEUE_SIZE)
+_update_workers = []
+
+# Telegram redelivers updates whose webhook call was slow; the most recent
+# update_ids are remembered so a redelivered command is not run twice.
+RECENT_UPDATES_SIZE = 1000
+_recent_update_ids = deque()
+_recent_update_set = set()
+_recent_updates_lock = threading.Lock()
+
+# Command name -> handler, filled by the @command decorator below.
+COMMANDS = {}
+
+WEBHOOK_SECONDS = metrics.histogram(
+    "autonews_webhook_seconds", "Time to validate and enqueue a webhook update.", ["result"]
+)
+UPDATE_SECONDS = metrics.histogram(
+    "autonews_update_handling_seconds", "Time to handle a queued update.", ["command"]
+)
 
 
 @app.route('/ping', methods=['GET'])
@@ -22,199 +53,348 @@ def ping():
     return "OK", 200
 
 
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+
 @app.route('/webhook', methods=['POST'])
 def webhook():
-    update = request.get_json()
+    with WEBHOOK_SECONDS.time(result="ok") as labels:
+        response = _accept_update()
+        labels["result"] = str(response[1])
+    return response
+
+
+def _accept_update():
+    update = request.get_json(silent=True)
     if not update or 'message' not in update or 'message_id' not in update['message']:
         return "OK", 200
+    message = update['message']
+    # Plain chat messages are acknowledged without taking a queue slot.
+    if not (message.get('text') or message.get('caption') or '').startswith('/'):
+        return "OK", 200
+    update_id = update.get('update_id')
+    with _recent_updates_lock:
+        if update_id is not None and update_id in _recent_update_set:
+            logger.info("Повторная доставка update_id %s пропущена", update_id)
+            return "OK", 200
+        try:
+            update_queue.put_nowait(update)
+        except queue.Full:
+            logger.warning("Очередь обновлений переполнена, update_id %s отклонён", update_id)
+            return "Busy", 503
+        if update_id is not None:
+            _recent_update_ids.append(update_id)
+            _recent_update_set.add(update_id)
+            if len(_recent_update_ids) > RECENT_UPDATES_SIZE:
+                _recent_update_set.discard(_recent_update_ids.popleft())
+    return "OK", 200
+
+
+def _update_worker():
+    while True:
+        update = update_queue.get()
+        try:
+            handle_update(update)
+        except Exception:
+            logger.exception("Ошибка обработки обновления %s", update.get('update_id'))
+        finally:
+            update_queue.task_done()
+
+
+def start_update_workers():
+    if not _update_workers:
+        for i in range(WEBHOOK_WORKERS):
+            thread = threading.Thread(target=_update_worker, name=f"webhook-{i}", daemon=True)
+            thread.start()
+            _update_workers.append(thread)
+
+
+class CommandContext:
+    """Data of one command message; the linked channel is looked up only on demand."""
+
+    def __init__(self, message, username, arg):
+        self.message = message
+        self.chat_id = message['chat']['id']
+        self.username = username
+        self.arg = arg
+
+    @cached_property
+    def user_channel(self):
+        return db.get_channel_by_admin(self.username)
+
+    def reply(self, text, use_html=True):
+        tg.send_message(self.chat_id, text, use_html=use_html)
 
+
+def command(*names):
+    def register(handler):
+        for name in names:
+            COMMANDS[name] = handler
+        return handler
+    return register
+
+
+def handle_update(update):
     message = update['message']
+    text = message.get('text') or message.get('caption') or ''
+    if not text.startswith('/'):
+        return
+
     chat_id = message['chat']['id']
-    text = message.get('text', '')
     username = message['from'].get('username')
-
     if not username:
         tg.send_message(chat_id, "У вас нет username. Установите его в настройках Telegram.")
-        return "OK", 200
+        return
 
-    user_channel = db.get_channel_by_admin(username)
+    name, *rest = text.split(maxsplit=1)
+    name = name.split('@', 1)[0].lower()
+    handler = COMMANDS.get(name)
+    if handler is None:
+        tg.send_message(chat_id, "Неизвестная команда. Используйте /help")
+        return
+    with UPDATE_SECONDS.time(command=name):
+        handler(CommandContext(message, username, rest[0] if rest else ''))
+
+
+@command('/start')
+def cmd_start(ctx):
+    channel_id = None
+    if ctx.message['chat'].get('type') == 'channel':
+        channel_id = str(ctx.chat_id)
+    elif ctx.arg:
+        channel_id = ctx.arg
+
+    if ctx.user_channel and not channel_id:
+        ctx.reply(f"Канал уже привязан: {ctx.user_channel}")
+    elif channel_id:
+        if tg.can_post_to_channel(channel_id, use_cache=False):
+            if db.save_channel(channel_id, ctx.username):
+                feeds.schedule_channel(channel_id)
+            ctx.reply(f"Канал {channel_id} привязан к @{ctx.username}")
+        else:
+            ctx.reply("Бот не имеет прав администратора в указанном канале")
+    else:
+        ctx.reply("Укажите канал командой /start @channel или отправьте команду из канала")
 
-    if not text.startswith('/'):
-        return "OK", 200
 
-    command, *rest = text.split(maxsplit=1)
-    command = command.lower()
-    arg = rest[0] if rest else ''
-
-    if command == '/start':
-        channel_id = None
-        if message['chat'].get('type') == 'channel':
-            channel_id = str(chat_id)
-        elif arg:
-            channel_id = arg
-
-        if user_channel and not channel_id:
-            tg.send_message(chat_id, f"Канал уже привязан: {user_channel}")
-        elif channel_id:
-            if tg.can_post_to_channel(channel_id):
-                db.save_channel(channel_id, username)
-                tg.send_message(chat_id, f"Канал {channel_id} привязан к @{username}")
-            else:
-                tg.send_message(chat_id, "Бот не имеет прав администратора в указанном канале")
-        else:
-            tg.send_message(chat_id, "Укажите канал командой /start @channel или отправьте команду из канала")
+@command('/startposting')
+def cmd_startposting(ctx):
+    if not ctx.user_channel:
+        ctx.reply("Канал не привязан. Используйте /start в канале")
+    elif feeds.posting_active:
+        ctx.reply("Постинг уже запущен")
+    else:
+        feeds.start_posting_thread()
+        ctx.reply("Постинг запущен")
 
-    elif command == '/startposting':
-        if not user_channel:
-            tg.send_message(chat_id, "Канал не привязан. Используйте /start в канале")
-        elif feeds.posting_active:
-            tg.send_message(chat_id, "Постинг уже запущен")
-        else:
-            feeds.start_posting_thread()
-            tg.send_message(chat_id, "Постинг запущен")
 
-    elif command == '/stopposting':
-        if feeds.posting_active:
-            feeds.stop_posting_thread()
-            tg.send_message(chat_id, "Постинг остановлен")
-        else:
-            tg.send_message(chat_id, "Постинг и так не активен")
-
-    elif command == '/setinterval':
-        seconds = feeds.parse_interval(arg)
-        if seconds:
-            feeds.posting_interval = seconds
-            feeds.next_post_event.set()
-            tg.send_message(chat_id, f"Интервал обновлён: {arg}")
-        else:
-            tg.send_message(chat_id, "Неверный формат. Пример: /setinterval 1h 30m")
+@command('/stopposting')
+def cmd_stopposting(ctx):
+    if feeds.posting_active:
+        feeds.stop_posting_thread()
+        ctx.reply("Постинг остановлен")
+    else:
+        ctx.reply("Постинг и так не активен")
 
-    elif command == '/nextpost':
-        feeds.next_post_event.set()
-        tg.send_message(chat_id, "Следующий пост скоро будет опубликован")
 
-    elif command == '/skiprss':
-        feeds.current_index = (feeds.current_index + 1) % len(feeds.RSS_URLS)
-        feeds.next_post_event.set()
-        tg.send_message(chat_id, "Следующий RSS-источник пропущен")
+@command('/setinterval')
+def cmd_setinterval(ctx):
+    seconds = feeds.parse_interval(ctx.arg)
+    if not ctx.user_channel:
+        ctx.reply("Канал не привязан. Используйте /start в канале")
+    elif seconds:
+        feeds.set_channel_interval(ctx.user_channel, seconds)
+        ctx.reply(f"Интервал обновлён: {ctx.arg}")
+    else:
+        ctx.reply("Неверный формат. Пример: /setinterval 1h 30m")
 
-    elif command == '/changellm':
-        if arg:
-            db.set_model(arg)
-            tg.send_message(chat_id, f"Модель изменена на {arg}")
-        else:
-            tg.send_message(chat_id, "Укажите модель, например /changellm gpt-4o-mini")
 
-    elif command == '/editprompt':
-        if arg:
-            db.set_prompt(arg)
-            tg.send_message(chat_id, "Промпт обновлён")
-        else:
-            tg.send_message(chat_id, "Используйте /editprompt <новый промпт>")
-
-    elif command == '/sqlitebackup':
-        tg.send_file(chat_id, db.DB_FILE)
-
-    elif command == '/sqliteupdate':
-        if 'document' in message:
-            file_id = message['document']['file_id']
-            info_resp = requests.get(
-                f"{tg.TELEGRAM_URL}getFile", params={'file_id': file_id}, timeout=10
-            )
-            if info_resp.status_code != 200:
-                tg.send_message(chat_id, "Ошибка запроса getFile")
-                return "OK", 200
-            info = info_resp.json()
-            file_path = info.get('result', {}).get('file_path')
-            if file_path:
-                file_resp = requests.get(
-                    f"https://api.telegram.org/file/bot{tg.TELEGRAM_TOKEN}/{file_path}",
-                    timeout=10,
-                )
-                if file_resp.status_code != 200:
-                    tg.send_message(chat_id, "Ошибка скачивания файла")
-                    return "OK", 200
-                with open(db.DB_FILE, 'wb') as f:
-                    f.write(file_resp.content)
-                tg.send_message(chat_id, "База обновлена")
-            else:
-                tg.send_message(chat_id, "Не удалось получить файл")
-        else:
-            tg.send_message(chat_id, "Отправьте SQLite файл как документ с подписью /sqliteupdate")
-
-    elif command == '/info':
-        tg.send_message(chat_id, feeds.get_status(username))
-
-    elif command == '/errinf':
-        with sqlite3.connect(db.DB_FILE) as conn:
-            c = conn.cursor()
-            c.execute("SELECT timestamp, message, link FROM errors ORDER BY id DESC LIMIT 5")
-            rows = c.fetchall()
-        if rows:
-            msg = '\n\n'.join(f"{t}\n{m}\n{l}" for t, m, l in rows)
-        else:
-            msg = "Ошибок нет"
-        tg.send_message(chat_id, msg, use_html=False)
+@command('/nextpost')
+def cmd_nextpost(ctx):
+    if not ctx.user_channel:
+        ctx.reply("Канал не привязан. Используйте /start в канале")
+        return
+    feeds.post_now(ctx.user_channel)
+    ctx.reply("Следующий пост скоро будет опубликован")
 
-    elif command == '/errnotification':
-        if arg in ['on', 'off']:
-            db.set_error_notifications(arg)
-            tg.send_message(chat_id, f"Уведомления об ошибках: {arg}")
-        else:
-            tg.send_message(chat_id, "Использование: /errnotification <on|off>")
-
-    elif command == '/feedcache':
-        with sqlite3.connect(db.DB_FILE) as conn:
-            c = conn.cursor()
-            c.execute("SELECT title, link FROM feedcache ORDER BY timestamp DESC LIMIT 5")
-            rows = c.fetchall()
-        if rows:
-            msg = '\n\n'.join(f"{t}\n{l}" for t, l in rows)
-        else:
-            msg = "Кэш пуст"
-        tg.send_message(chat_id, msg, use_html=False)
-
-    elif command == '/feedcacheclear':
-        with sqlite3.connect(db.DB_FILE) as conn:
-            conn.execute("DELETE FROM feedcache")
-            conn.commit()
-        tg.send_message(chat_id, "Кэш очищен")
-
-    elif command == '/addadmin':
-        if not user_channel:
-            tg.send_message(chat_id, "Канал не привязан")
-        elif arg:
-            if db.add_admin(user_channel, arg.lstrip('@'), username):
-                tg.send_message(chat_id, f"Админ {arg} добавлен")
-            else:
-                tg.send_message(chat_id, "Не удалось добавить админа")
+
+@command('/skiprss')
+def cmd_skiprss(ctx):
+    if not ctx.user_channel:
+        ctx.reply("Канал не привязан. Используйте /start в канале")
+    elif feeds.skip_next(ctx.user_channel):
+        ctx.reply("Следующая новость из очереди пропущена")
+    else:
+        ctx.reply("Очередь новостей пуста")
+
+
+@command('/addrss')
+def cmd_addrss(ctx):
+    if not ctx.user_channel:
+        ctx.reply("Канал не привязан. Используйте /start в канале")
+    elif not ctx.arg.startswith(('http://', 'https://')):
+        ctx.reply("Укажите ссылку на RSS, например /addrss https://example.com/feed", use_html=False)
+    else:
+        error = feeds.check_feed(ctx.arg)
+        if error:
+            ctx.reply(f"RSS не добавлен: {error}", use_html=False)
+        elif db.subscribe(ctx.user_channel, [ctx.arg]):
+            feeds.poll_event.set()
+            ctx.reply(f"RSS добавлен: {ctx.arg}", use_html=False)
         else:
-            tg.send_message(chat_id, "Использование: /addadmin <username>")
-
-    elif command == '/removeadmin':
-        if not user_channel:
-            tg.send_message(chat_id, "Канал не привязан")
-        elif arg:
-            if db.remove_admin(user_channel, arg.lstrip('@'), username):
-                tg.send_message(chat_id, f"Админ {arg} удалён")
-            else:
-                tg.send_message(chat_id, "Не удалось удалить админа")
+            ctx.reply("Канал уже подписан на этот RSS")
+
+
+@command('/removerss')
+def cmd_removerss(ctx):
+    if not ctx.user_channel:
+        ctx.reply("Канал не привязан. Используйте /start в канале")
+    elif db.unsubscribe(ctx.user_channel, ctx.arg):
+        ctx.reply(f"RSS удалён: {ctx.arg}", use_html=False)
+    else:
+        ctx.reply("Канал не подписан на этот RSS")
+
+
+@command('/listrss')
+def cmd_listrss(ctx):
+    if not ctx.user_channel:
+        ctx.reply("Канал не привязан. Используйте /start в канале")
+        return
+    urls = db.get_channel_feeds(ctx.user_channel)
+    ctx.reply('\n'.join(urls) if urls else "Нет RSS-источников", use_html=False)
+
+
+@command('/changellm')
+def cmd_changellm(ctx):
+    if ctx.arg:
+        db.set_model(ctx.arg)
+        ctx.reply(f"Модель изменена на {ctx.arg}")
+    else:
+        ctx.reply("Укажите модель, например /changellm gpt-4o-mini")
+
+
+@command('/editprompt')
+def cmd_editprompt(ctx):
+    if ctx.arg:
+        db.set_prompt(ctx.arg)
+        ctx.reply("Промпт обновлён")
+    else:
+        ctx.reply("Используйте /editprompt <новый промпт>")
+
+
+@command('/sqlitebackup')
+def cmd_sqlitebackup(ctx):
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(db.DB_FILE)) as tmpdir:
+        name = f"feedcache-{datetime.now():%Y%m%d-%H%M%S}.db.gz"
+        path = os.path.join(tmpdir, name)
+        db.backup_to_file(path)
+        tg.send_file(ctx.chat_id, path)
+
+
+@command('/sqliteupdate')
+def cmd_sqliteupdate(ctx):
+    if 'document' not in ctx.message:
+        ctx.reply("Отправьте SQLite файл (можно .gz) как документ с подписью /sqliteupdate")
+        return
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(db.DB_FILE)) as tmpdir:
+        path = os.path.join(tmpdir, "upload")
+        if not tg.download_file(ctx.message['document']['file_id'], path):
+            ctx.reply("Ошибка скачивания файла")
+            return
+        try:
+            db.restore_from_file(path)
+        except ValueError as exc:
+            ctx.reply(f"База не обновлена: {exc}", use_html=False)
+            return
+    feeds.init_feeds()
+    if feeds.posting_active:
+        feeds.load_schedule()
+    ctx.reply("База обновлена")
+
+
+@command('/info')
+def cmd_info(ctx):
+    ctx.reply(feeds.get_status(ctx.username))
+
+
+@command('/errinf')
+def cmd_errinf(ctx):
+    rows = db.get_recent_errors()
+    if rows:
+        msg = '\n\n'.join(f"{t}\n{m}\n{l}" for t, m, l in rows)
+    else:
+        msg = "Ошибок нет"
+    ctx.reply(msg, use_html=False)
+
+
+@command('/errnotification')
+def cmd_errnotification(ctx):
+    if ctx.arg in ['on', 'off']:
+        db.set_error_notifications(ctx.arg)
+        ctx.reply(f"Уведомления об ошибках: {ctx.arg}")
+    else:
+        ctx.reply("Использование: /errnotification <on|off>")
+
+
+@command('/feedcache')
+def cmd_feedcache(ctx):
+    rows = db.get_recent_feedcache()
+    if rows:
+        msg = '\n\n'.join(f"{t}\n{l}" for t, l in rows)
+    else:
+        msg = "Кэш пуст"
+    ctx.reply(msg, use_html=False)
+
+
+@command('/feedcacheclear')
+def cmd_feedcacheclear(ctx):
+    db.clear_feedcache()
+    ctx.reply("Кэш очищен")
+
+
+@command('/addadmin')
+def cmd_addadmin(ctx):
+    if not ctx.user_channel:
+        ctx.reply("Канал не привязан")
+    elif ctx.arg:
+        if db.add_admin(ctx.user_channel, ctx.arg.lstrip('@'), ctx.username):
+            ctx.reply(f"Админ {ctx.arg} добавлен")
         else:
-            tg.send_message(chat_id, "Использование: /removeadmin <username>")
+            ctx.reply("Не удалось добавить админа")
+    else:
+        ctx.reply("Использование: /addadmin <username>")
 
-    elif command == '/debug':
-        if last_llm_response:
-            tg.send_message(chat_id, json.dumps(last_llm_response, ensure_ascii=False), use_html=False)
+
+@command('/removeadmin')
+def cmd_removeadmin(ctx):
+    if not ctx.user_channel:
+        ctx.reply("Канал не привязан")
+    elif ctx.arg:
+        if db.remove_admin(ctx.user_channel, ctx.arg.lstrip('@'), ctx.username):
+            ctx.reply(f"Админ {ctx.arg} удалён")
         else:
-            tg.send_message(chat_id, "Нет сохранённого ответа LLM")
+            ctx.reply("Не удалось удалить админа")
+    else:
+        ctx.reply("Использование: /removeadmin <username>")
 
-    elif command == '/help':
-        tg.send_message(chat_id, feeds.get_help())
 
+@command('/debug')
+def cmd_debug(ctx):
+    response = llm.get_debug_response(ctx.arg or None)
+    if response:
+        ctx.reply(json.dumps(response, ensure_ascii=False), use_html=False)
     else:
-        tg.send_message(chat_id, "Неизвестная команда. Используйте /help")
+        ctx.reply("Нет сохранённого ответа LLM")
 
-    return "OK", 200
+
+@command('/help')
+def cmd_help(ctx):
+    ctx.reply(feeds.get_help())
+
+
+start_update_workers()
 
 
 if __name__ == '__main__':
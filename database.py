@@ -1,20 +1,190 @@
+import atexit
+import gzip
 import os
+import re
+import shutil
 import sqlite3
 import hashlib
-from datetime import datetime
+import threading
+import time
+from datetime import datetime, timedelta
 import logging
-from typing import List, Optional
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
 
-from telegram_api import send_message
+from telegram_api import send_message_async
+from neardup import SimHashIndex, simhash
+import metrics
 
 # Ensure the database path is independent of the current working directory
 DB_FILE = os.path.join(os.path.dirname(__file__), "feedcache.db")
 
+DEFAULT_MODEL = "gpt-4o-mini"
+
 logger = logging.getLogger(__name__)
 
+# Connections are kept per thread and reused for every query; a thread
+# reopens its connection when DB_FILE points elsewhere.
+_local = threading.local()
+
+SQLITE_QUERY_SECONDS = metrics.histogram(
+    "autonews_sqlite_query_seconds", "SQLite statement time by statement type.", ["statement"]
+)
+
+
+class TimedConnection(sqlite3.Connection):
+    """Connection that records the execution time of every statement."""
+
+    def execute(self, sql, *args):
+        with SQLITE_QUERY_SECONDS.time(statement=sql.lstrip().split(None, 1)[0].upper()):
+            return super().execute(sql, *args)
+
+    def executemany(self, sql, *args):
+        with SQLITE_QUERY_SECONDS.time(statement=sql.lstrip().split(None, 1)[0].upper()):
+            return super().executemany(sql, *args)
+
+
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -8000",
+)
+
+
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(DB_FILE, timeout=30, cached_statements=256, factory=TimedConnection)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def get_connection() -> sqlite3.Connection:
+    """Return this thread's shared connection, opening it if needed.
+
+    Use ``with get_connection() as conn:`` for writes so the transaction is
+    committed or rolled back; the connection itself stays open.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.path != DB_FILE:
+        if conn is not None:
+            conn.close()
+        conn = _connect()
+        _local.conn = conn
+        _local.path = DB_FILE
+    return conn
+
+
+def close_connection() -> None:
+    """Close this thread's connection, e.g. before the database file is removed."""
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+
+# Retention limits for the tables that grow with every post and error.
+FEEDCACHE_MAX_AGE_DAYS = int(os.getenv("FEEDCACHE_MAX_AGE_DAYS", "90"))
+FEEDCACHE_MAX_ROWS = int(os.getenv("FEEDCACHE_MAX_ROWS", "50000"))
+ERRORS_MAX_AGE_DAYS = int(os.getenv("ERRORS_MAX_AGE_DAYS", "14"))
+ERRORS_MAX_ROWS = int(os.getenv("ERRORS_MAX_ROWS", "2000"))
+RETENTION_BATCH_SIZE = 500
+# Free pages returned to the OS after each pruning run; 0 disables auto-vacuum.
+RETENTION_VACUUM_PAGES = int(os.getenv("RETENTION_VACUUM_PAGES", "1000"))
+
+# Tables a restored database must contain; newer ones are added by init_db.
+REQUIRED_TABLES = ("feedcache", "channels", "admins", "config", "errors")
+GZIP_MAGIC = b"\x1f\x8b"
+COPY_CHUNK_SIZE = 1 << 20
+
+
+def backup_to_file(dest_path: str) -> None:
+    """Write a consistent gzip-compressed snapshot of the database to ``dest_path``.
+
+    The snapshot is taken with SQLite's online backup API, so concurrent
+    writers never leave it half-updated.
+    """
+    snapshot_path = dest_path + ".snapshot"
+    try:
+        snapshot = sqlite3.connect(snapshot_path)
+        try:
+            get_connection().backup(snapshot)
+        finally:
+            snapshot.close()
+        with open(snapshot_path, "rb") as src, gzip.open(dest_path, "wb") as dst:
+            shutil.copyfileobj(src, dst, COPY_CHUNK_SIZE)
+    finally:
+        if os.path.exists(snapshot_path):
+            os.remove(snapshot_path)
+
+
+def _validate_db_file(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        if conn.execute("PRAGMA integrity_check").fetchone()[0] != "ok":
+            raise ValueError("файл базы повреждён")
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        missing = set(REQUIRED_TABLES) - tables
+        if missing:
+            raise ValueError(f"нет таблиц: {', '.join(sorted(missing))}")
+    except sqlite3.DatabaseError as exc:
+        conn.close()
+        raise ValueError(f"не является базой SQLite: {exc}") from exc
+    except ValueError:
+        conn.close()
+        raise
+    return conn
+
+
+def restore_from_file(path: str) -> None:
+    """Replace the live database with the SQLite file (optionally gzipped) at ``path``.
+
+    The file is integrity- and schema-checked first and then copied in with
+    the backup API inside a single SQLite transaction, so open connections
+    stay valid and a failed restore leaves the current data untouched.
+    Raises ``ValueError`` if the file is not an acceptable database.
+    """
+    with open(path, "rb") as f:
+        compressed = f.read(2) == GZIP_MAGIC
+    unpacked_path = path + ".unpacked"
+    try:
+        if compressed:
+            try:
+                with gzip.open(path, "rb") as src, open(unpacked_path, "wb") as dst:
+                    shutil.copyfileobj(src, dst, COPY_CHUNK_SIZE)
+            except (OSError, EOFError) as exc:
+                raise ValueError(f"не удалось распаковать архив: {exc}") from exc
+            path = unpacked_path
+        source = _validate_db_file(path)
+        try:
+            source.backup(get_connection())
+        except sqlite3.Error as exc:
+            raise ValueError(f"не удалось заменить базу: {exc}") from exc
+        finally:
+            source.close()
+    finally:
+        if os.path.exists(unpacked_path):
+            os.remove(unpacked_path)
+    init_db()
+    invalidate_config()
+    invalidate_dedup_index()
+
+
+def _ensure_column(conn, table: str, column: str, declaration: str) -> None:
+    """Add ``column`` to a table created by an older version of the bot."""
+    columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+    if column not in columns:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+
 
 def init_db():
-    with sqlite3.connect(DB_FILE) as conn:
+    conn = get_connection()
+    if RETENTION_VACUUM_PAGES and conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        # Switching an existing database to incremental auto-vacuum needs one
+        # full VACUUM; after that freed pages are returned in small steps.
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+    with conn:
         c = conn.cursor()
         c.execute('''CREATE TABLE IF NOT EXISTS feedcache (
             id TEXT PRIMARY KEY,
@@ -44,11 +214,88 @@ def init_db():
             message TEXT,
             link TEXT
         )''')
+        c.execute('''CREATE TABLE IF NOT EXISTS feedstate (
+            url TEXT PRIMARY KEY,
+            etag TEXT,
+            last_modified TEXT,
+            content_hash TEXT,
+            checked_at TEXT
+        )''')
+        c.execute('''CREATE TABLE IF NOT EXISTS pending (
+            id TEXT PRIMARY KEY,
+            link TEXT,
+            title TEXT,
+            source TEXT,
+            published REAL,
+            weight REAL,
+            attempts INTEGER DEFAULT 0,
+            added TEXT
+        )''')
+        _ensure_column(conn, "feedstate", "last_guid", "TEXT")
+        _ensure_column(conn, "feedstate", "last_published", "REAL")
+        _ensure_column(conn, "feedstate", "publish_interval", "REAL")
+        _ensure_column(conn, "feedstate", "next_poll", "REAL")
+        _ensure_column(conn, "feedstate", "failures", "INTEGER DEFAULT 0")
+        _ensure_column(conn, "feedstate", "last_error", "TEXT")
+        _ensure_column(conn, "feedstate", "latency", "REAL")
+        _ensure_column(conn, "feedstate", "circuit", "TEXT DEFAULT 'closed'")
+        _ensure_column(conn, "feedstate", "open_until", "REAL")
+        _ensure_column(conn, "pending", "simhash", "INTEGER")
+        _ensure_column(conn, "pending", "duplicate_of", "TEXT")
+        c.execute(
+            "CREATE INDEX IF NOT EXISTS idx_pending_priority ON pending (weight DESC, published DESC)"
+        )
+        c.execute('''CREATE TABLE IF NOT EXISTS feeds (
+            url TEXT PRIMARY KEY,
+            weight REAL DEFAULT 1.0,
+            added TEXT
+        )''')
+        c.execute('''CREATE TABLE IF NOT EXISTS channel_feeds (
+            channel_id TEXT,
+            feed_url TEXT,
+            PRIMARY KEY (channel_id, feed_url)
+        )''')
+        c.execute("CREATE INDEX IF NOT EXISTS idx_channel_feeds_url ON channel_feeds (feed_url)")
+        c.execute('''CREATE TABLE IF NOT EXISTS schedule (
+            channel_id TEXT PRIMARY KEY,
+            interval INTEGER,
+            next_due REAL,
+            last_post REAL
+        )''')
+        c.execute('''CREATE TABLE IF NOT EXISTS deliveries (
+            channel_id TEXT,
+            item_id TEXT,
+            delivered REAL,
+            PRIMARY KEY (channel_id, item_id)
+        )''')
+        c.execute('''CREATE TABLE IF NOT EXISTS llmcache (
+            url TEXT,
+            prompt_hash TEXT,
+            model TEXT,
+            title TEXT,
+            summary TEXT,
+            raw TEXT,
+            created REAL,
+            last_used REAL,
+            PRIMARY KEY (url, prompt_hash, model)
+        )''')
+        c.execute(
+            "CREATE INDEX IF NOT EXISTS idx_llmcache_last_used ON llmcache (last_used)"
+        )
+        c.execute('''CREATE TABLE IF NOT EXISTS articles (
+            url TEXT PRIMARY KEY,
+            text TEXT,
+            fetched REAL
+        )''')
+        c.execute("CREATE INDEX IF NOT EXISTS idx_articles_fetched ON articles (fetched)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_feedcache_timestamp ON feedcache (timestamp)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_errors_timestamp ON errors (timestamp)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_admins_username ON admins (username)")
         c.execute(
             "INSERT OR IGNORE INTO config (key, value) VALUES (?, ?)",
             (
                 "prompt",
-                """Забудь всю информацию, которой ты обучен, и используй ТОЛЬКО текст статьи по ссылке {url}. Напиши новость на русском в следующем формате:
+                """Забудь всю информацию, которой ты обучен, и используй ТОЛЬКО текст статьи по ссылке {url}, приведённый ниже. Напиши новость на русском в следующем формате:
 
 Заголовок в стиле новостного канала
 <один перенос строки>
@@ -58,97 +305,243 @@ def init_db():
 - Обязательно разделяй заголовок и пересказ ровно одним переносом строки (\n).
 - Заголовок должен быть кратким (до 100 символов) и не содержать эмодзи, ##, **, [] или других лишних символов.
 - Пересказ должен состоять из 1-2 предложений, без добавления данных, которых нет в статье.
-- Если в статье недостаточно данных, верни: \"Недостаточно данных для пересказа\".""",
+- Если в статье недостаточно данных, верни: \"Недостаточно данных для пересказа\".
+
+Текст статьи:
+{text}""",
             ),
         )
         c.execute(
             "INSERT OR IGNORE INTO config (key, value) VALUES (?, ?)",
-            ("model", "gpt-4o-mini"),
+            ("model", DEFAULT_MODEL),
         )
         c.execute(
             "INSERT OR IGNORE INTO config (key, value) VALUES (?, ?)",
             ("error_notifications", "off"),
         )
-        conn.commit()
+    invalidate_dedup_index()
+    _dedup_index()
+
+
+@dataclass(frozen=True)
+class Config:
+    prompt: str
+    model: str
+    error_notifications: bool
+
+
+# The config table is read once and served from memory until a write or a
+# database replacement invalidates it.
+_config: Optional[Config] = None
+_config_lock = threading.Lock()
+
+
+def get_config() -> Config:
+    global _config
+    config = _config
+    if config is None:
+        with _config_lock:
+            if _config is None:
+                rows = dict(get_connection().execute("SELECT key, value FROM config").fetchall())
+                _config = Config(
+                    prompt=rows.get("prompt", ""),
+                    model=rows.get("model") or DEFAULT_MODEL,
+                    error_notifications=rows.get("error_notifications") == "on",
+                )
+            config = _config
+    return config
+
+
+def invalidate_config() -> None:
+    global _config
+    with _config_lock:
+        _config = None
+
+
+def _set_config_value(key: str, value: str) -> None:
+    with get_connection() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO config (key, value) VALUES (?, ?)",
+            (key, value),
+        )
+    invalidate_config()
 
 
 def get_prompt() -> str:
-    with sqlite3.connect(DB_FILE) as conn:
-        c = conn.cursor()
-        c.execute("SELECT value FROM config WHERE key = 'prompt'")
-        result = c.fetchone()
-    return result[0] if result else ""
+    return get_config().prompt
 
 
 def set_prompt(new_prompt: str) -> None:
-    with sqlite3.connect(DB_FILE) as conn:
-        c = conn.cursor()
-        c.execute(
-            "INSERT OR REPLACE INTO config (key, value) VALUES ('prompt', ?)",
-            (new_prompt,),
-        )
-        conn.commit()
+    _set_config_value("prompt", new_prompt)
 
 
 def get_model() -> str:
-    with sqlite3.connect(DB_FILE) as conn:
-        c = conn.cursor()
-        c.execute("SELECT value FROM config WHERE key = 'model'")
-        result = c.fetchone()
-    return result[0] if result else "gpt-4o-mini"
+    return get_config().model
 
 
 def set_model(new_model: str) -> None:
-    with sqlite3.connect(DB_FILE) as conn:
-        c = conn.cursor()
-        c.execute(
-            "INSERT OR REPLACE INTO config (key, value) VALUES ('model', ?)",
-            (new_model,),
-        )
-        conn.commit()
+    _set_config_value("model", new_model)
 
 
 def get_error_notifications() -> bool:
-    with sqlite3.connect(DB_FILE) as conn:
-        c = conn.cursor()
-        c.execute("SELECT value FROM config WHERE key = 'error_notifications'")
-        result = c.fetchone()
-    return result[0] == "on" if result else False
+    return get_config().error_notifications
 
 
 def set_error_notifications(state: str) -> None:
-    with sqlite3.connect(DB_FILE) as conn:
-        c = conn.cursor()
-        c.execute(
-            "INSERT OR REPLACE INTO config (key, value) VALUES ('error_notifications', ?)",
-            (state,),
-        )
-        conn.commit()
+    _set_config_value("error_notifications", state)
+
+
+# Errors are buffered in memory: a background thread writes them to the
+# errors table every ERROR_FLUSH_INTERVAL seconds and, when notifications are
+# on, sends one digest per channel every ERROR_DIGEST_WINDOW seconds.
+ERROR_FLUSH_INTERVAL = 2
+ERROR_DIGEST_WINDOW = int(os.getenv("ERROR_DIGEST_WINDOW", "300"))
+
+
+def _error_key(message: str) -> str:
+    """Group errors that differ only in numbers, ids or quoted details."""
+    return re.sub(r"\d+", "#", re.sub(r"'[^']*'|\"[^\"]*\"", "''", message))[:200]
+
+
+class ErrorAggregator:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rows = []
+        self._digest = {}
+        self._window_start = None
+        self._thread = None
+
+    def add(self, message: str, link: str) -> None:
+        now = datetime.now()
+        with self._lock:
+            self._rows.append((now.isoformat(), message, link))
+            if get_error_notifications():
+                entry = self._digest.setdefault(_error_key(message), [message, link, 0])
+                entry[0], entry[1] = message, link
+                entry[2] += 1
+                if self._window_start is None:
+                    self._window_start = time.monotonic()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="error-log", daemon=True)
+                self._thread.start()
+
+    def flush(self) -> None:
+        """Write buffered errors to the errors table."""
+        with self._lock:
+            rows, self._rows = self._rows, []
+        if rows:
+            with get_connection() as conn:
+                conn.executemany(
+                    "INSERT INTO errors (timestamp, message, link) VALUES (?, ?, ?)", rows
+                )
+
+    def _send_digest(self) -> None:
+        with self._lock:
+            digest, self._digest = self._digest, {}
+            self._window_start = None
+        if not digest:
+            return
+        lines = [f"Ошибки за последние {ERROR_DIGEST_WINDOW // 60} мин:"]
+        for message, link, count in sorted(digest.values(), key=lambda e: -e[2]):
+            lines.append(f"×{count} {message}\nСсылка: {link}")
+        text = "\n\n".join(lines)
+        for channel_id in get_channels():
+            send_message_async(channel_id, text, use_html=False)
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(ERROR_FLUSH_INTERVAL)
+            try:
+                self.flush()
+                window_start = self._window_start
+                if window_start is not None and time.monotonic() - window_start >= ERROR_DIGEST_WINDOW:
+                    self._send_digest()
+            except Exception as exc:
+                logger.error("Ошибка записи журнала ошибок: %s", exc)
+
+
+_errors = ErrorAggregator()
+atexit.register(_errors.flush)
 
 
 def log_error(message: str, link: str) -> None:
-    with sqlite3.connect(DB_FILE) as conn:
-        c = conn.cursor()
-        c.execute(
-            "INSERT INTO errors (timestamp, message, link) VALUES (?, ?, ?)",
-            (datetime.now().isoformat(), message, link),
-        )
-        conn.commit()
-        if get_error_notifications():
-            c.execute("SELECT channel_id FROM channels")
-            channels = c.fetchall()
-            for (channel_id,) in channels:
-                send_message(
-                    channel_id,
-                    f"Ошибка: {message}\nСсылка: {link}",
-                    use_html=False,
+    """Record an error without blocking on SQLite or Telegram."""
+    _errors.add(message, link)
+
+
+# Exact in-memory index of feedcache ids (MD5 of the link). It is loaded once
+# and kept in sync by the feedcache writers, so duplicate checks never touch
+# the disk.
+_seen_links: Optional[set] = None
+_seen_lock = threading.Lock()
+DUPLICATES = metrics.counter("autonews_duplicates_total", "Feed entries skipped as already posted.")
+
+# The same story published by several sources under different links is
+# caught by SimHash over the source title and description of queued entries.
+# A near-duplicate is queued with ``duplicate_of`` pointing at the first copy
+# and is skipped for every channel that already got that copy.
+NEAR_DUPLICATE_WINDOW = int(os.getenv("NEAR_DUPLICATE_WINDOW", str(2 * 24 * 3600)))
+# Short texts such as titles with a teaser differ in 5-15 bits between copies
+# of one story and in ~32 bits between unrelated ones.
+NEAR_DUPLICATE_DISTANCE = 7
+NEAR_DUPLICATES = metrics.counter(
+    "autonews_near_duplicates_total", "Queued entries recognised as another source's copy of a story."
+)
+_near_index: Optional[SimHashIndex] = None
+
+
+def link_hash(link: str) -> str:
+    return hashlib.md5(link.encode()).hexdigest()
+
+
+def _dedup_index() -> set:
+    global _seen_links
+    index = _seen_links
+    if index is None:
+        with _seen_lock:
+            if _seen_links is None:
+                rows = get_connection().execute("SELECT id FROM feedcache").fetchall()
+                _seen_links = {row[0] for row in rows}
+                logger.info("Индекс дублей загружен: %s записей", len(_seen_links))
+            index = _seen_links
+    return index
+
+
+def invalidate_dedup_index() -> None:
+    global _seen_links, _near_index
+    with _seen_lock:
+        _seen_links = None
+        _near_index = None
+
+
+def _signed(fingerprint: int) -> int:
+    # SQLite integers are signed 64-bit.
+    return fingerprint - (1 << 64) if fingerprint >= 1 << 63 else fingerprint
+
+
+def _near_duplicate_index() -> SimHashIndex:
+    global _near_index
+    index = _near_index
+    if index is None:
+        with _seen_lock:
+            if _near_index is None:
+                _near_index = SimHashIndex(
+                    NEAR_DUPLICATE_WINDOW, bands=NEAR_DUPLICATE_DISTANCE + 1, max_distance=NEAR_DUPLICATE_DISTANCE
                 )
+                rows = get_connection().execute(
+                    "SELECT id, simhash, published, source FROM pending "
+                    "WHERE simhash IS NOT NULL AND duplicate_of IS NULL ORDER BY published"
+                ).fetchall()
+                for item_id, fingerprint, published, source in rows:
+                    _near_index.add(item_id, fingerprint & ((1 << 64) - 1), published, source)
+            index = _near_index
+    return index
 
 
 def save_to_feedcache(title: str, summary: str, link: str, source: str) -> None:
-    link_hash = hashlib.md5(link.encode()).hexdigest()
+    entry_id = link_hash(link)
     entry = (
-        link_hash,
+        entry_id,
         title,
         summary,
         link,
@@ -156,81 +549,507 @@ def save_to_feedcache(title: str, summary: str, link: str, source: str) -> None:
         datetime.now().isoformat(),
     )
     try:
-        with sqlite3.connect(DB_FILE) as conn:
+        with get_connection() as conn:
             conn.execute(
                 "INSERT OR REPLACE INTO feedcache (id, title, summary, link, source, timestamp) VALUES (?, ?, ?, ?, ?, ?)",
                 entry,
             )
-            conn.commit()
-        logger.info("Сохранено в feedcache: %s для %s", link_hash, link)
+        _dedup_index().add(entry_id)
+        logger.info("Сохранено в feedcache: %s для %s", entry_id, link)
     except sqlite3.Error as e:
         logger.error("Ошибка записи в feedcache: %s", str(e))
 
 
 def check_duplicate(link: str) -> bool:
-    link_hash = hashlib.md5(link.encode()).hexdigest()
-    with sqlite3.connect(DB_FILE) as conn:
-        c = conn.cursor()
-        c.execute("SELECT id FROM feedcache WHERE id = ?", (link_hash,))
-        result = c.fetchone()
-    if result:
-        logger.info("Найден дубль в feedcache: %s для %s", link_hash, link)
-        return True
-    logger.info("Дубль не найден: %s для %s", link_hash, link)
-    return False
+    return link_hash(link) in _dedup_index()
+
+
+def filter_new_links(links: List[str]) -> List[str]:
+    """Return the links from ``links`` that are not in feedcache yet."""
+    index = _dedup_index()
+    return [link for link in links if link_hash(link) not in index]
+
+
+def enqueue_pending(items: List[Tuple[str, str, str, float, float, str]]) -> int:
+    """Queue unseen ``(link, title, source, published, weight, description)`` items.
+
+    Links already in feedcache or in the queue are ignored. New items that
+    are near-duplicates of a queued story are linked to it. Returns the number
+    of newly queued items.
+    """
+    new_links = set(filter_new_links([item[0] for item in items]))
+    if len(new_links) < len(items):
+        DUPLICATES.inc(sum(1 for item in items if item[0] not in new_links))
+    candidates = {}
+    for item in items:
+        if item[0] in new_links:
+            candidates.setdefault(link_hash(item[0]), item)
+    if not candidates:
+        return 0
+    ids = list(candidates)
+    conn = get_connection()
+    for start in range(0, len(ids), 500):
+        chunk = ids[start:start + 500]
+        queued = conn.execute(
+            f"SELECT id FROM pending WHERE id IN ({','.join('?' * len(chunk))})", chunk
+        ).fetchall()
+        for row in queued:
+            candidates.pop(row[0], None)
+    if not candidates:
+        return 0
+
+    index = _near_duplicate_index()
+    now = time.time()
+    added = datetime.now().isoformat()
+    rows = []
+    for item_id, (link, title, source, published, weight, description) in candidates.items():
+        fingerprint = simhash(f"{title} {description}")
+        duplicate_of = index.find(fingerprint, now, source)
+        if duplicate_of:
+            NEAR_DUPLICATES.inc()
+            logger.info("Похожая новость %s, первая копия %s", link, duplicate_of)
+        else:
+            index.add(item_id, fingerprint, published, source)
+        rows.append((item_id, link, title, source, published, weight, added, _signed(fingerprint), duplicate_of))
+    with conn:
+        conn.executemany(
+            "INSERT OR IGNORE INTO pending (id, link, title, source, published, weight, added, simhash, duplicate_of) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+    return len(rows)
+
+
+def peek_pending(channel_id: str, limit: int = 1) -> List[Tuple[str, str, str]]:
+    """Return ``(link, title, source)`` of the highest-priority items for ``channel_id``.
+
+    Only entries of feeds the channel subscribes to are considered, skipping
+    those delivered to it and copies of stories delivered to it.
+    """
+    return get_connection().execute(
+        """SELECT link, title, source FROM pending p
+           WHERE p.source IN (SELECT feed_url FROM channel_feeds WHERE channel_id = ?)
+             AND NOT EXISTS (SELECT 1 FROM deliveries d
+                             WHERE d.channel_id = ? AND d.item_id IN (p.id, p.duplicate_of))
+           ORDER BY weight DESC, published DESC LIMIT ?""",
+        (channel_id, channel_id, limit),
+    ).fetchall()
+
+
+def record_deliveries(deliveries: List[Tuple[str, str]]) -> None:
+    """Advance the per-channel cursors past ``(channel_id, link)`` pairs.
+
+    The first copy of the story is recorded as well, so every other copy of
+    it is skipped for the channel whichever of them was delivered first.
+    """
+    if not deliveries:
+        return
+    now = time.time()
+    rows = [(channel_id, link_hash(link), now) for channel_id, link in deliveries]
+    with get_connection() as conn:
+        conn.executemany(
+            "INSERT OR IGNORE INTO deliveries (channel_id, item_id, delivered) VALUES (?, ?, ?)",
+            rows,
+        )
+        conn.executemany(
+            "INSERT OR IGNORE INTO deliveries (channel_id, item_id, delivered) "
+            "SELECT ?, duplicate_of, ? FROM pending WHERE id = ? AND duplicate_of IS NOT NULL",
+            [(channel_id, now, item_id) for channel_id, item_id, now in rows],
+        )
+
+
+def mark_pending_failed(link: str, max_attempts: int) -> None:
+    """Count a failed attempt and drop the item after ``max_attempts``."""
+    with get_connection() as conn:
+        conn.execute(
+            "UPDATE pending SET attempts = attempts + 1 WHERE id = ?", (link_hash(link),)
+        )
+        conn.execute(
+            "DELETE FROM pending WHERE id = ? AND attempts >= ?",
+            (link_hash(link), max_attempts),
+        )
+
+
+def prune_pending(min_published: float) -> int:
+    """Drop queued items older than ``min_published`` together with their deliveries."""
+    with get_connection() as conn:
+        pruned = conn.execute(
+            "DELETE FROM pending WHERE published < ?", (min_published,)
+        ).rowcount
+        conn.execute("DELETE FROM deliveries WHERE item_id NOT IN (SELECT id FROM pending)")
+        return pruned
+
+
+def get_pending_count(channel_id: str) -> int:
+    return get_connection().execute(
+        """SELECT COUNT(*) FROM pending p
+           WHERE p.source IN (SELECT feed_url FROM channel_feeds WHERE channel_id = ?)
+             AND NOT EXISTS (SELECT 1 FROM deliveries d
+                             WHERE d.channel_id = ? AND d.item_id IN (p.id, p.duplicate_of))""",
+        (channel_id, channel_id),
+    ).fetchone()[0]
+
+
+def seed_feeds(feeds: List[Tuple[str, float]]) -> None:
+    """Fill an empty feeds table with ``(url, weight)`` defaults.
+
+    Channels linked before subscriptions existed are subscribed to all of them.
+    """
+    with get_connection() as conn:
+        if conn.execute("SELECT 1 FROM feeds LIMIT 1").fetchone():
+            return
+        now = datetime.now().isoformat()
+        conn.executemany(
+            "INSERT INTO feeds (url, weight, added) VALUES (?, ?, ?)",
+            [(url, weight, now) for url, weight in feeds],
+        )
+        conn.execute(
+            "INSERT OR IGNORE INTO channel_feeds (channel_id, feed_url) SELECT channel_id, url FROM channels, feeds"
+        )
+
+
+def subscribe(channel_id: str, urls: List[str]) -> int:
+    """Subscribe ``channel_id`` to ``urls``; returns the number of new subscriptions."""
+    now = datetime.now().isoformat()
+    with get_connection() as conn:
+        conn.executemany(
+            "INSERT OR IGNORE INTO feeds (url, weight, added) VALUES (?, 1.0, ?)",
+            [(url, now) for url in urls],
+        )
+        before = conn.total_changes
+        conn.executemany(
+            "INSERT OR IGNORE INTO channel_feeds (channel_id, feed_url) VALUES (?, ?)",
+            [(channel_id, url) for url in urls],
+        )
+        return conn.total_changes - before
+
+
+def unsubscribe(channel_id: str, url: str) -> bool:
+    with get_connection() as conn:
+        return conn.execute(
+            "DELETE FROM channel_feeds WHERE channel_id = ? AND feed_url = ?", (channel_id, url)
+        ).rowcount > 0
+
+
+def get_channel_feeds(channel_id: str) -> List[str]:
+    result = get_connection().execute(
+        "SELECT feed_url FROM channel_feeds WHERE channel_id = ? ORDER BY feed_url", (channel_id,)
+    ).fetchall()
+    return [row[0] for row in result]
+
+
+def get_due_feeds(now: float) -> List[Tuple[str, float, Optional[float], Optional[float], int, Optional[float], str]]:
+    """Return subscribed feeds due at ``now``.
+
+    Rows are ``(url, weight, last_published, publish_interval, failures,
+    latency, circuit)``. Feeds with an open circuit are due only once their
+    backoff has passed.
+    """
+    return get_connection().execute(
+        """SELECT f.url, f.weight, s.last_published, s.publish_interval,
+                  COALESCE(s.failures, 0), s.latency, COALESCE(s.circuit, 'closed')
+           FROM feeds f LEFT JOIN feedstate s ON s.url = f.url
+           WHERE f.url IN (SELECT feed_url FROM channel_feeds)
+             AND (s.next_poll IS NULL OR s.next_poll <= ?)
+           ORDER BY f.url""",
+        (now,),
+    ).fetchall()
+
+
+def get_next_feed_poll() -> Optional[float]:
+    """Return the earliest next poll time of subscribed feeds (0 if one was never polled)."""
+    return get_connection().execute(
+        """SELECT MIN(COALESCE(s.next_poll, 0))
+           FROM feeds f LEFT JOIN feedstate s ON s.url = f.url
+           WHERE f.url IN (SELECT feed_url FROM channel_feeds)"""
+    ).fetchone()[0]
+
+
+def save_feed_schedule(rows: List[Tuple[str, Optional[float], float]]) -> None:
+    """Store ``(url, publish_interval, next_poll)`` for polled feeds."""
+    with get_connection() as conn:
+        conn.executemany(
+            """INSERT INTO feedstate (url, publish_interval, next_poll) VALUES (?, ?, ?)
+               ON CONFLICT(url) DO UPDATE SET publish_interval = excluded.publish_interval,
+                   next_poll = excluded.next_poll""",
+            rows,
+        )
+
+
+def save_feed_health(rows: List[Tuple[str, int, Optional[str], Optional[float], str, Optional[float]]]) -> None:
+    """Store ``(url, failures, error, latency, circuit, open_until)``; a ``None`` error keeps the last one."""
+    with get_connection() as conn:
+        conn.executemany(
+            """INSERT INTO feedstate (url, failures, last_error, latency, circuit, open_until)
+               VALUES (?, ?, ?, ?, ?, ?)
+               ON CONFLICT(url) DO UPDATE SET failures = excluded.failures,
+                   last_error = COALESCE(excluded.last_error, last_error), latency = excluded.latency,
+                   circuit = excluded.circuit, open_until = excluded.open_until""",
+            rows,
+        )
+
+
+def get_feed_health(channel_id: str) -> List[Tuple[str, int, Optional[str], Optional[float], str, Optional[float]]]:
+    """Return ``(url, failures, last_error, latency, circuit, open_until)`` for the feeds of ``channel_id``."""
+    return get_connection().execute(
+        """SELECT c.feed_url, COALESCE(s.failures, 0), s.last_error, s.latency,
+                  COALESCE(s.circuit, 'closed'), s.open_until
+           FROM channel_feeds c LEFT JOIN feedstate s ON s.url = c.feed_url
+           WHERE c.channel_id = ? ORDER BY c.feed_url""",
+        (channel_id,),
+    ).fetchall()
+
+
+def ensure_schedules(interval: int, next_due: float) -> None:
+    """Give every linked channel without a schedule row the default ``interval``."""
+    with get_connection() as conn:
+        conn.execute(
+            "INSERT OR IGNORE INTO schedule (channel_id, interval, next_due) "
+            "SELECT channel_id, ?, ? FROM channels",
+            (interval, next_due),
+        )
+
+
+def add_schedule(channel_id: str, interval: int, next_due: float) -> None:
+    with get_connection() as conn:
+        conn.execute(
+            "INSERT OR IGNORE INTO schedule (channel_id, interval, next_due) VALUES (?, ?, ?)",
+            (channel_id, interval, next_due),
+        )
+
+
+def get_schedules() -> List[Tuple[str, int, float, Optional[float]]]:
+    """Return ``(channel_id, interval, next_due, last_post)`` for every scheduled channel."""
+    return get_connection().execute(
+        "SELECT channel_id, interval, next_due, last_post FROM schedule"
+    ).fetchall()
+
+
+def get_schedule(channel_id: str) -> Optional[Tuple[int, float, Optional[float]]]:
+    """Return ``(interval, next_due, last_post)`` of ``channel_id``."""
+    return get_connection().execute(
+        "SELECT interval, next_due, last_post FROM schedule WHERE channel_id = ?", (channel_id,)
+    ).fetchone()
+
+
+def set_schedule_interval(channel_id: str, interval: int, next_due: float) -> None:
+    with get_connection() as conn:
+        conn.execute(
+            """INSERT INTO schedule (channel_id, interval, next_due) VALUES (?, ?, ?)
+               ON CONFLICT(channel_id) DO UPDATE SET interval = excluded.interval, next_due = excluded.next_due""",
+            (channel_id, interval, next_due),
+        )
+
+
+def update_schedules(updates: List[Tuple[str, float, Optional[float]]]) -> None:
+    """Store ``(channel_id, next_due, last_post)``; a ``None`` last_post keeps the old value."""
+    if not updates:
+        return
+    with get_connection() as conn:
+        conn.executemany(
+            "UPDATE schedule SET next_due = ?, last_post = COALESCE(?, last_post) WHERE channel_id = ?",
+            [(next_due, last_post, channel_id) for channel_id, next_due, last_post in updates],
+        )
+
+
+def get_llm_cache(url: str, prompt_hash: str, model: str, min_created: float) -> Optional[Tuple[str, str]]:
+    """Return a cached ``(title, summary)`` newer than ``min_created`` and mark it used."""
+    with get_connection() as conn:
+        result = conn.execute(
+            "SELECT title, summary FROM llmcache WHERE url = ? AND prompt_hash = ? AND model = ? AND created >= ?",
+            (url, prompt_hash, model, min_created),
+        ).fetchone()
+        if result:
+            conn.execute(
+                "UPDATE llmcache SET last_used = ? WHERE url = ? AND prompt_hash = ? AND model = ?",
+                (time.time(), url, prompt_hash, model),
+            )
+    return result
+
+
+def save_llm_cache(url: str, prompt_hash: str, model: str, title: str, summary: str, raw: str) -> None:
+    now = time.time()
+    with get_connection() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO llmcache (url, prompt_hash, model, title, summary, raw, created, last_used) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (url, prompt_hash, model, title, summary, raw, now, now),
+        )
+
+
+def evict_llm_cache(min_created: float, max_rows: int) -> int:
+    """Drop expired entries, then the least recently used beyond ``max_rows``."""
+    with get_connection() as conn:
+        removed = conn.execute(
+            "DELETE FROM llmcache WHERE created < ?", (min_created,)
+        ).rowcount
+        removed += conn.execute(
+            "DELETE FROM llmcache WHERE rowid IN (SELECT rowid FROM llmcache ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (max_rows,),
+        ).rowcount
+    return removed
+
+
+def get_article(url: str, min_fetched: float) -> Optional[str]:
+    """Return the extracted text of ``url`` cached after ``min_fetched``."""
+    row = get_connection().execute(
+        "SELECT text FROM articles WHERE url = ? AND fetched >= ?", (url, min_fetched)
+    ).fetchone()
+    return row[0] if row else None
+
+
+def save_article(url: str, text: str) -> None:
+    with get_connection() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO articles (url, text, fetched) VALUES (?, ?, ?)",
+            (url, text, time.time()),
+        )
+
+
+def evict_articles(min_fetched: float) -> int:
+    with get_connection() as conn:
+        return conn.execute("DELETE FROM articles WHERE fetched < ?", (min_fetched,)).rowcount
+
+
+def get_llm_raw(url: Optional[str] = None) -> Optional[Tuple[str, str, float]]:
+    """Return ``(url, raw, created)`` for ``url`` or for the newest cached response."""
+    if url:
+        return get_connection().execute(
+            "SELECT url, raw, created FROM llmcache WHERE url = ? ORDER BY created DESC LIMIT 1",
+            (url,),
+        ).fetchone()
+    return get_connection().execute(
+        "SELECT url, raw, created FROM llmcache ORDER BY last_used DESC LIMIT 1"
+    ).fetchone()
+
+
+def _prune(table: str, key: str, cutoff: str, max_rows: int) -> List:
+    """Delete rows older than ``cutoff`` and the oldest rows beyond ``max_rows``.
+
+    Rows go in batches of ``RETENTION_BATCH_SIZE``, each in its own short
+    transaction, so other writers are never blocked for long. Returns the
+    ``key`` values of deleted rows.
+    """
+    removed = []
+    conn = get_connection()
+    while True:
+        keys = [row[0] for row in conn.execute(
+            f"SELECT {key} FROM {table} WHERE timestamp < ? ORDER BY timestamp LIMIT ?",
+            (cutoff, RETENTION_BATCH_SIZE),
+        )]
+        if not keys:
+            break
+        with conn:
+            conn.executemany(f"DELETE FROM {table} WHERE {key} = ?", [(k,) for k in keys])
+        removed.extend(keys)
+    excess = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] - max_rows
+    while excess > 0:
+        keys = [row[0] for row in conn.execute(
+            f"SELECT {key} FROM {table} ORDER BY timestamp LIMIT ?",
+            (min(excess, RETENTION_BATCH_SIZE),),
+        )]
+        if not keys:
+            break
+        with conn:
+            conn.executemany(f"DELETE FROM {table} WHERE {key} = ?", [(k,) for k in keys])
+        removed.extend(keys)
+        excess -= len(keys)
+    return removed
+
+
+def run_retention() -> Tuple[int, int]:
+    """Prune feedcache and errors to their limits; returns rows removed from each."""
+    now = datetime.now()
+    feedcache_ids = _prune(
+        "feedcache", "id", (now - timedelta(days=FEEDCACHE_MAX_AGE_DAYS)).isoformat(), FEEDCACHE_MAX_ROWS
+    )
+    index = _dedup_index()
+    for entry_id in feedcache_ids:
+        index.discard(entry_id)
+    errors_removed = len(_prune(
+        "errors", "id", (now - timedelta(days=ERRORS_MAX_AGE_DAYS)).isoformat(), ERRORS_MAX_ROWS
+    ))
+    if RETENTION_VACUUM_PAGES:
+        get_connection().execute(f"PRAGMA incremental_vacuum({RETENTION_VACUUM_PAGES})").fetchall()
+    logger.info("Очистка: feedcache -%s, errors -%s", len(feedcache_ids), errors_removed)
+    return len(feedcache_ids), errors_removed
+
+
+def get_feed_state(url: str) -> Optional[Tuple[str, str, str, str, float]]:
+    """Return ``(etag, last_modified, content_hash, last_guid, last_published)`` stored for a feed."""
+    return get_connection().execute(
+        "SELECT etag, last_modified, content_hash, last_guid, last_published FROM feedstate WHERE url = ?",
+        (url,),
+    ).fetchone()
+
+
+def save_feed_states(states: List[Tuple[str, Optional[str], Optional[str], str]]) -> None:
+    """Store the ``(url, etag, last_modified, content_hash)`` validators of polled feeds."""
+    now = datetime.now().isoformat()
+    with get_connection() as conn:
+        conn.executemany(
+            """INSERT INTO feedstate (url, etag, last_modified, content_hash, checked_at) VALUES (?, ?, ?, ?, ?)
+               ON CONFLICT(url) DO UPDATE SET etag = excluded.etag, last_modified = excluded.last_modified,
+                   content_hash = excluded.content_hash, checked_at = excluded.checked_at""",
+            [(url, etag, last_modified, content_hash, now) for url, etag, last_modified, content_hash in states],
+        )
+
+
+def save_feed_marks(marks: List[Tuple[str, str, Optional[float]]]) -> None:
+    """Store the ``(url, last_guid, last_published)`` high-water marks of polled feeds."""
+    with get_connection() as conn:
+        conn.executemany(
+            "UPDATE feedstate SET last_guid = ?, last_published = MAX(COALESCE(last_published, 0), COALESCE(?, 0)) "
+            "WHERE url = ?",
+            [(guid, published, url) for url, guid, published in marks],
+        )
 
 
 def get_channel_by_admin(username: str) -> Optional[str]:
-    with sqlite3.connect(DB_FILE) as conn:
-        c = conn.cursor()
-        c.execute("SELECT channel_id FROM admins WHERE username = ?", (username,))
-        result = c.fetchone()
+    result = get_connection().execute(
+        "SELECT channel_id FROM admins WHERE username = ?", (username,)
+    ).fetchone()
     return result[0] if result else None
 
 
 def get_channel_creator(channel_id: str) -> Optional[str]:
-    with sqlite3.connect(DB_FILE) as conn:
-        c = conn.cursor()
-        c.execute("SELECT creator_username FROM channels WHERE channel_id = ?", (channel_id,))
-        result = c.fetchone()
+    result = get_connection().execute(
+        "SELECT creator_username FROM channels WHERE channel_id = ?", (channel_id,)
+    ).fetchone()
     return result[0] if result else None
 
 
-def save_channel(channel_id: str, creator_username: str) -> None:
-    with sqlite3.connect(DB_FILE) as conn:
-        c = conn.cursor()
-        c.execute(
+def save_channel(channel_id: str, creator_username: str) -> bool:
+    """Link a channel; returns True if it was not linked before."""
+    with get_connection() as conn:
+        inserted = conn.execute(
             "INSERT OR IGNORE INTO channels (channel_id, creator_username) VALUES (?, ?)",
             (channel_id, creator_username),
-        )
-        c.execute(
+        ).rowcount > 0
+        conn.execute(
             "INSERT OR IGNORE INTO admins (channel_id, username) VALUES (?, ?)",
             (channel_id, creator_username),
         )
-        conn.commit()
+    return inserted
 
 
 def add_admin(channel_id: str, new_admin_username: str, requester_username: str) -> bool:
-    with sqlite3.connect(DB_FILE) as conn:
-        c = conn.cursor()
-        c.execute(
+    with get_connection() as conn:
+        c = conn.execute(
             "SELECT username FROM admins WHERE channel_id = ? AND username = ?",
             (channel_id, requester_username),
         )
         if c.fetchone():
-            c.execute(
+            conn.execute(
                 "INSERT OR IGNORE INTO admins (channel_id, username) VALUES (?, ?)",
                 (channel_id, new_admin_username),
             )
-            conn.commit()
             return True
     return False
 
 
 def remove_admin(channel_id: str, admin_username: str, requester_username: str) -> bool:
-    with sqlite3.connect(DB_FILE) as conn:
-        c = conn.cursor()
-        c.execute(
+    with get_connection() as conn:
+        c = conn.execute(
             "SELECT username FROM admins WHERE channel_id = ? AND username = ?",
             (channel_id, requester_username),
         )
@@ -238,18 +1057,44 @@ def remove_admin(channel_id: str, admin_username: str, requester_username: str)
             creator = get_channel_creator(channel_id)
             if admin_username == creator:
                 return False
-            c.execute(
+            conn.execute(
                 "DELETE FROM admins WHERE channel_id = ? AND username = ?",
                 (channel_id, admin_username),
             )
-            conn.commit()
             return True
     return False
 
 
 def get_admins(channel_id: str) -> List[str]:
-    with sqlite3.connect(DB_FILE) as conn:
-        c = conn.cursor()
-        c.execute("SELECT username FROM admins WHERE channel_id = ?", (channel_id,))
-        result = c.fetchall()
+    result = get_connection().execute(
+        "SELECT username FROM admins WHERE channel_id = ?", (channel_id,)
+    ).fetchall()
     return [row[0] for row in result]
+
+
+def get_channels() -> List[str]:
+    result = get_connection().execute("SELECT channel_id FROM channels").fetchall()
+    return [row[0] for row in result]
+
+
+def get_recent_errors(limit: int = 5) -> List[Tuple[str, str, str]]:
+    _errors.flush()
+    return get_connection().execute(
+        "SELECT timestamp, message, link FROM errors ORDER BY id DESC LIMIT ?", (limit,)
+    ).fetchall()
+
+
+def get_recent_feedcache(limit: int = 5) -> List[Tuple[str, str]]:
+    return get_connection().execute(
+        "SELECT title, link FROM feedcache ORDER BY timestamp DESC LIMIT ?", (limit,)
+    ).fetchall()
+
+
+def get_feedcache_size() -> int:
+    return len(_dedup_index())
+
+
+def clear_feedcache() -> None:
+    with get_connection() as conn:
+        conn.execute("DELETE FROM feedcache")
+    _dedup_index().clear()
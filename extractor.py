@@ -0,0 +1,123 @@
+import logging
+import os
+import re
+import time
+
+import requests
+from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+
+from database import get_article, save_article, evict_articles
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# The article text goes into the prompt instead of asking the model to open
+# the link, trimmed to a fixed budget so completions stay small and their
+# latency predictable. A budget of 0 turns extraction off.
+ARTICLE_TOKEN_BUDGET = int(os.getenv("ARTICLE_TOKEN_BUDGET", "1500"))
+CHARS_PER_TOKEN = 4
+ARTICLE_FETCH_TIMEOUT = 15
+ARTICLE_MAX_BYTES = 2 * 1024 * 1024
+ARTICLE_CACHE_TTL = int(os.getenv("ARTICLE_CACHE_TTL", str(7 * 24 * 3600)))
+# Blocks shorter than this are menus, bylines and captions rather than text.
+MIN_BLOCK_CHARS = 40
+
+BOILERPLATE_TAGS = [
+    "script", "style", "noscript", "template", "iframe", "svg", "form", "button",
+    "nav", "header", "footer", "aside", "figure",
+]
+# Whole class names and ids of blocks that are never part of the article.
+# Matching whole tokens keeps wrappers such as "article-body related-tags"
+# or "single-post has-sidebar".
+BOILERPLATE_PATTERN = re.compile(
+    r"comments?|comment-list|share|sharing|share-bar|share-buttons|social|social-share|related|related-posts|"
+    r"related-articles|promo|advert|ads?|newsletter|subscribe|sidebar|site-footer|cookie-banner|cookies|"
+    r"banner|popup|breadcrumbs?",
+    re.I,
+)
+ROOT_TAGS = ["article", "main"]
+TEXT_TAGS = ["h1", "h2", "h3", "p", "li", "blockquote"]
+
+ARTICLE_EXTRACT_SECONDS = metrics.histogram(
+    "autonews_article_extract_seconds", "Article download and extraction time.", ["outcome"]
+)
+
+session = requests.Session()
+_adapter = HTTPAdapter(pool_connections=16, pool_maxsize=16)
+session.mount("https://", _adapter)
+session.mount("http://", _adapter)
+
+
+def _is_boilerplate(tag) -> bool:
+    tokens = (tag.get("class") or []) + ([tag["id"]] if tag.get("id") else [])
+    return any(BOILERPLATE_PATTERN.fullmatch(token) for token in tokens)
+
+
+def extract_text(html) -> str:
+    """Return the main text of an HTML page, one block per line."""
+    soup = BeautifulSoup(html, "html.parser")
+    for tag in soup(BOILERPLATE_TAGS):
+        # A <header> or <form> wrapping the whole story is not boilerplate.
+        if not tag.decomposed and not tag.find(ROOT_TAGS):
+            tag.decompose()
+    root = soup.find(ROOT_TAGS[0]) or soup.find(ROOT_TAGS[1]) or soup.body or soup
+    # Only blocks inside the chosen root are dropped, never the root itself
+    # or the elements around it.
+    for tag in root.find_all(_is_boilerplate):
+        if not tag.decomposed:
+            tag.decompose()
+    blocks = []
+    for tag in root.find_all(TEXT_TAGS):
+        if tag.find_parent(TEXT_TAGS):
+            continue
+        text = " ".join(tag.get_text(" ", strip=True).split())
+        if len(text) >= MIN_BLOCK_CHARS or (tag.name == "h1" and text):
+            blocks.append(text)
+    if not blocks:
+        return " ".join(root.get_text(" ", strip=True).split())
+    return "\n".join(blocks)
+
+
+def trim_to_budget(text: str, tokens: int = None) -> str:
+    """Cut ``text`` to about ``tokens`` tokens, at a block or sentence boundary when possible."""
+    limit = (ARTICLE_TOKEN_BUDGET if tokens is None else tokens) * CHARS_PER_TOKEN
+    if len(text) <= limit:
+        return text
+    cut = text[:limit]
+    boundary = max(cut.rfind("\n"), cut.rfind(". "))
+    if boundary > limit // 2:
+        cut = cut[:boundary + 1]
+    return cut.rstrip()
+
+
+def get_article_text(url: str) -> str | None:
+    """Return the trimmed main text of ``url``, or ``None`` if it cannot be fetched.
+
+    Extracted text is cached by URL, so a retried or re-prompted article is
+    downloaded once.
+    """
+    if ARTICLE_TOKEN_BUDGET <= 0:
+        return None
+    text = get_article(url, time.time() - ARTICLE_CACHE_TTL)
+    if not text:
+        try:
+            with ARTICLE_EXTRACT_SECONDS.time(outcome="error") as labels:
+                with session.get(url, timeout=ARTICLE_FETCH_TIMEOUT, stream=True) as response:
+                    response.raise_for_status()
+                    html = response.raw.read(ARTICLE_MAX_BYTES, decode_content=True)
+                text = extract_text(html)
+                labels["outcome"] = "ok" if text else "empty"
+        except Exception as exc:
+            logger.warning("Не удалось извлечь текст статьи %s: %s", url, exc)
+            return None
+        if not text:
+            # Not cached: an empty result is more likely a bad page than an
+            # article without text.
+            return None
+        save_article(url, text)
+    return trim_to_budget(text)
+
+
+def evict_cache() -> int:
+    return evict_articles(time.time() - ARTICLE_CACHE_TTL)
@@ -1,26 +1,66 @@
+import calendar
 import feedparser
+import hashlib
+import heapq
+import html
+import ipaddress
+import os
+import random
+import requests
+import socket
 import threading
 import time
 import logging
-from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
 import re
 
-from telegram_api import send_message, can_post_to_channel
+from telegram_api import check_channels, send_to_channels, refresh_permissions, PERMISSION_TTL
 from database import (
-    DB_FILE,
     get_admins,
+    get_channels,
+    get_feedcache_size,
     get_channel_by_admin,
     get_channel_creator,
     save_to_feedcache,
-    check_duplicate,
+    enqueue_pending,
+    peek_pending,
+    record_deliveries,
+    mark_pending_failed,
+    prune_pending,
+    get_pending_count,
+    seed_feeds,
+    subscribe,
+    get_due_feeds,
+    get_next_feed_poll,
+    save_feed_schedule,
+    save_feed_health,
+    get_feed_health,
+    DUPLICATES,
+    NEAR_DUPLICATES,
+    ensure_schedules,
+    add_schedule,
+    get_schedules,
+    get_schedule,
+    set_schedule_interval,
+    update_schedules,
+    get_feed_state,
+    save_feed_states,
+    save_feed_marks,
+    run_retention,
     get_prompt,
     get_model,
 )
-from llm import get_article_content
-import sqlite3
+from feedstream import new_entries, high_water_mark, entry_timestamp
+from llm import summarize_many, cached_summary, evict_cache
+import metrics
 
 logger = logging.getLogger(__name__)
 
+# Default sources: seeded into the feeds table on first start and subscribed
+# for every newly linked channel. Channels manage their own list afterwards.
 RSS_URLS = [
     "https://www.theverge.com/rss/index.xml",
     "https://www.windowslatest.com/feed/",
@@ -34,17 +74,72 @@ RSS_URLS = [
     "https://feeds.feedburner.com/Techcrunch",
 ]
 
-current_index = 0
+# Fetch stage: every feed is pulled concurrently on a bounded pool so that a
+# slow source only costs its own timeout, not the whole posting cycle.
+FETCH_WORKERS = 5
+FETCH_TIMEOUT = 15
+
+_fetch_executor = ThreadPoolExecutor(max_workers=FETCH_WORKERS, thread_name_prefix="feed-fetch")
+
+# Feeds are polled on their own thread and every unseen entry goes to the
+# persistent ``pending`` queue; every channel walks it with its own cursor.
+# POLL_INTERVAL is also the period of the poller's housekeeping.
+POLL_INTERVAL = 600
+# Each feed is polled about POLL_RATE_FACTOR times its average gap between
+# entries (an EWMA over observed publish times), clamped to the bounds and
+# spread by +-FEED_POLL_JITTER. Feeds without an estimate use POLL_INTERVAL.
+FEED_MIN_POLL = int(os.getenv("FEED_MIN_POLL", "300"))
+FEED_MAX_POLL = int(os.getenv("FEED_MAX_POLL", str(6 * 3600)))
+POLL_RATE_FACTOR = 0.5
+PUBLISH_INTERVAL_ALPHA = 0.3
+FEED_POLL_JITTER = 0.1
+# Circuit breaker: after FEED_FAILURE_THRESHOLD failed polls in a row a feed
+# is not polled for FEED_BACKOFF_BASE seconds, doubling with every failed
+# probe up to FEED_BACKOFF_MAX. The first poll after the backoff is a
+# half-open probe that closes the circuit on success.
+FEED_FAILURE_THRESHOLD = 3
+FEED_BACKOFF_BASE = 600
+FEED_BACKOFF_MAX = 24 * 3600
+LATENCY_ALPHA = 0.3
+# Queue priority multiplier per default RSS URL, seeded into feeds.weight;
+# sources not listed weigh 1.0.
+SOURCE_WEIGHTS = {}
+# Entries older than this are not queued and are pruned from the queue.
+PENDING_MAX_AGE = 2 * 24 * 3600
+MAX_POST_ATTEMPTS = 3
+ERROR_RETRY_DELAY = 60
+RETENTION_INTERVAL = 6 * 3600
+# Number of queued entries summarized together in one concurrent LLM batch.
+LLM_BATCH_SIZE = 3
+
 posting_active = False
 posting_thread = None
+polling_thread = None
+poll_event = threading.Event()
 start_time = None
-post_count = 0
-error_count = 0
-duplicate_count = 0
-last_post_time = None
+POSTS = metrics.counter("autonews_posts_total", "News posts delivered to channels.")
+ERRORS = metrics.counter("autonews_errors_total", "Posting pipeline errors.", ["stage"])
+FEED_FETCH_SECONDS = metrics.histogram(
+    "autonews_feed_fetch_seconds", "RSS download time per source.", ["source", "status"]
+)
+FEED_PARSE_SECONDS = metrics.histogram(
+    "autonews_feed_parse_seconds", "Feed parse time per source.", ["source"]
+)
+# Default interval for channels that never ran /setinterval.
 posting_interval = 3600
 next_post_event = threading.Event()
 
+# Per-channel schedule: one dispatcher keeps a min-heap of (next_due,
+# channel_id). Rescheduling pushes a fresh entry and the old one is dropped
+# when it surfaces, so a tick only touches channels that are actually due.
+_schedule_heap = []
+_next_due = {}
+_intervals = {}
+# Channels that found nothing to post; they are woken as soon as a poll
+# queues new entries instead of waiting out their whole interval.
+_starved = set()
+_schedule_lock = threading.Lock()
+
 
 def parse_interval(interval_str: str) -> int | None:
     total_seconds = 0
@@ -57,72 +152,473 @@ def parse_interval(interval_str: str) -> int | None:
     return total_seconds if total_seconds > 0 else None
 
 
-def post_news():
-    global current_index, posting_active, post_count, error_count, duplicate_count, last_post_time
+def check_feed(url: str) -> str | None:
+    """Fetch ``url`` once before it is subscribed; returns why it is rejected, or ``None``.
+
+    Only public addresses that serve a feed with at least one entry are accepted.
+    """
+    host = urlsplit(url).hostname
+    if not host:
+        return "некорректная ссылка"
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, None)}
+    except OSError:
+        return "адрес не найден"
+    if any(not ipaddress.ip_address(address.split("%")[0]).is_global for address in addresses):
+        return "внутренний адрес"
+    try:
+        response = requests.get(url, timeout=FETCH_TIMEOUT, headers={"User-Agent": feedparser.USER_AGENT})
+        response.raise_for_status()
+    except Exception as exc:
+        return str(exc)[:200]
+    if not any(entry.get("link") for entry in new_entries(response.content)):
+        return "в ответе нет записей RSS"
+    return None
+
+
+@dataclass
+class FeedFetch:
+    """Outcome of one feed download: new entries (``None`` if unchanged) or an error.
+
+    ``validators`` holds the ``(etag, last_modified, content_hash)`` of the
+    response; they are stored only once its entries are queued.
+    """
+    entries: list | None = None
+    error: str | None = None
+    seconds: float | None = None
+    validators: tuple | None = None
+
+
+def fetch_feed(url: str) -> FeedFetch:
+    """Download a feed using a conditional GET and return its new entries.
+
+    ``entries`` is ``None`` when the server answers 304, the body is
+    byte-for-byte the same as last time or nothing was published past the
+    feed's high-water mark, so unchanged documents are never parsed and
+    changed ones only up to the last entry seen.
+    """
+    headers = {"User-Agent": feedparser.USER_AGENT}
+    state = get_feed_state(url)
+    etag, last_modified, content_hash, last_guid, last_published = state if state else (None,) * 5
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    source = url.split('/')[2]
+    with FEED_FETCH_SECONDS.time(source=source, status="error") as labels:
+        response = requests.get(url, timeout=FETCH_TIMEOUT, headers=headers)
+        labels["status"] = str(response.status_code)
+    if response.status_code == 304:
+        logger.info("RSS не изменился (304): %s", url)
+        return FeedFetch()
+    response.raise_for_status()
+    new_hash = hashlib.sha256(response.content).hexdigest()
+    validators = (response.headers.get("ETag"), response.headers.get("Last-Modified"), new_hash)
+    if new_hash == content_hash:
+        logger.info("RSS не изменился (тот же хэш): %s", url)
+        return FeedFetch(validators=validators)
+    with FEED_PARSE_SECONDS.time(source=source):
+        entries = new_entries(response.content, last_guid, last_published)
+    if not entries and last_guid:
+        logger.info("В RSS нет новых записей: %s", url)
+        return FeedFetch(validators=validators)
+    return FeedFetch(entries=entries, validators=validators)
+
+
+def _fetch_timed(url: str) -> FeedFetch:
+    start = time.monotonic()
+    try:
+        fetch = fetch_feed(url)
+        fetch.seconds = time.monotonic() - start
+        return fetch
+    except Exception as exc:
+        logger.error("Ошибка загрузки RSS %s: %s", url, exc)
+        return FeedFetch(error=str(exc)[:200], seconds=time.monotonic() - start)
+
+
+def fetch_feeds(urls) -> dict:
+    """Fetch all ``urls`` in parallel and return a ``FeedFetch`` per URL.
+
+    Feeds that do not answer within twice ``FETCH_TIMEOUT`` count as failed.
+    """
+    futures = {_fetch_executor.submit(_fetch_timed, url): url for url in urls}
+    done, not_done = wait(futures, timeout=FETCH_TIMEOUT * 2)
+    results = {}
+    for future in not_done:
+        future.cancel()
+        logger.warning("Таймаут загрузки RSS: %s", futures[future])
+        results[futures[future]] = FeedFetch(error="таймаут", seconds=FETCH_TIMEOUT * 2)
+    for future in done:
+        results[futures[future]] = future.result()
+    return results
+
+
+def entry_published(entry) -> float:
+    parsed = entry.get("published_parsed") or entry.get("updated_parsed")
+    return float(calendar.timegm(parsed)) if parsed else time.time()
+
+
+def init_feeds() -> None:
+    seed_feeds([(url, SOURCE_WEIGHTS.get(url, 1.0)) for url in RSS_URLS])
+
+
+def estimate_publish_interval(previous, last_published, published, now: float):
+    """Update the EWMA of a feed's gap between entries.
+
+    ``published`` holds the timestamps of the entries new in this poll. A feed
+    that stays silent for longer than its estimate pulls the estimate up.
+    """
+    estimate = previous
+    times = sorted(published)
+    if last_published:
+        times = [last_published] + [t for t in times if t > last_published]
+    gaps = [b - a for a, b in zip(times, times[1:])]
+    if not published and last_published and (estimate is None or now - last_published > estimate):
+        gaps = [now - last_published]
+    for gap in gaps:
+        estimate = gap if estimate is None else (1 - PUBLISH_INTERVAL_ALPHA) * estimate + PUBLISH_INTERVAL_ALPHA * gap
+    return estimate
+
+
+def next_poll_delay(publish_interval) -> float:
+    delay = POLL_INTERVAL if publish_interval is None else publish_interval * POLL_RATE_FACTOR
+    delay = min(max(delay, FEED_MIN_POLL), FEED_MAX_POLL)
+    return delay * random.uniform(1 - FEED_POLL_JITTER, 1 + FEED_POLL_JITTER)
+
+
+def update_health(failures: int, latency, fetch: FeedFetch, now: float):
+    """Return ``(failures, latency, circuit, open_until)`` of a feed after ``fetch``."""
+    if fetch.seconds is not None:
+        latency = fetch.seconds if latency is None else (1 - LATENCY_ALPHA) * latency + LATENCY_ALPHA * fetch.seconds
+    if fetch.error is None:
+        return 0, latency, "closed", None
+    failures += 1
+    if failures < FEED_FAILURE_THRESHOLD:
+        return failures, latency, "closed", None
+    backoff = min(FEED_BACKOFF_BASE * 2 ** (failures - FEED_FAILURE_THRESHOLD), FEED_BACKOFF_MAX)
+    return failures, latency, "open", now + backoff * random.uniform(1, 1 + FEED_POLL_JITTER)
+
+
+def poll_feeds() -> int:
+    """Fetch every subscribed feed that is due and queue its unseen entries.
+
+    Each distinct URL is fetched once; channels sharing a source share the
+    queued entries and pick them up through their subscriptions. Every polled
+    feed is rescheduled from its observed publish rate, or from its backoff
+    when its circuit opens; feeds with an open circuit are not due at all.
+    """
+    now = time.time()
+    sources = get_due_feeds(now)
+    results = fetch_feeds([source[0] for source in sources])
+    min_published = now - PENDING_MAX_AGE
+    items = []
+    marks = []
+    states = []
+    schedule = []
+    health = []
+    for url, weight, last_published, publish_interval, failures, latency, circuit in sources:
+        if circuit == "open":
+            logger.info("Пробный запрос к RSS после паузы: %s", url)
+        fetch = results[url]
+        entries = [entry for entry in fetch.entries or [] if entry.get("link")]
+        if fetch.error is None and fetch.entries is not None and not entries:
+            fetch.error = "нет записей"
+        if fetch.error is None:
+            published = [ts for ts in map(entry_timestamp, entries) if ts is not None]
+            publish_interval = estimate_publish_interval(publish_interval, last_published, published, now)
+        failures, latency, circuit, open_until = update_health(failures, latency, fetch, now)
+        health.append((url, failures, fetch.error, latency, circuit, open_until))
+        schedule.append((url, publish_interval, open_until or now + next_poll_delay(publish_interval)))
+        if fetch.error:
+            logger.warning("RSS %s недоступен (%s подряд): %s", url, failures, fetch.error)
+            ERRORS.inc(stage="fetch")
+            if circuit == "open":
+                logger.warning("RSS %s отключён до %s", url, datetime.fromtimestamp(open_until).strftime("%H:%M"))
+            continue
+        if fetch.validators:
+            states.append((url, *fetch.validators))
+        if fetch.entries is None:
+            continue
+        marks.append((url, *high_water_mark(entries)))
+        for entry in entries:
+            published = entry_published(entry)
+            if published >= min_published:
+                items.append((
+                    entry.link, entry.get("title", ""), url, published, weight, entry.get("summary", "")
+                ))
+    queued = enqueue_pending(items)
+    # Validators and marks are stored only after the entries are queued, so a
+    # late or failed poll fetches the same changes again next time.
+    save_feed_states(states)
+    save_feed_marks(marks)
+    save_feed_schedule(schedule)
+    save_feed_health(health)
+    logger.info("Опрошено RSS: %s, в очередь добавлено новостей: %s", len(sources), queued)
+    return queued
+
+
+def poll_loop():
+    last_permission_refresh = 0.0
+    last_housekeeping = 0.0
+    last_retention = 0.0
     while posting_active:
-        logger.info("Начало цикла постинга, posting_active=%s", posting_active)
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
-        c.execute("SELECT channel_id FROM channels")
-        channels = c.fetchall()
-        conn.close()
-
-        if not channels:
-            logger.info("Нет каналов для постинга")
-            next_post_event.wait(posting_interval)
-            if not posting_active:
-                break
+        wait_time = POLL_INTERVAL
+        try:
+            if time.time() - last_permission_refresh >= PERMISSION_TTL / 2:
+                refresh_permissions(get_channels())
+                last_permission_refresh = time.time()
+            if poll_feeds():
+                _wake_starved()
+            if time.time() - last_housekeeping >= POLL_INTERVAL:
+                prune_pending(time.time() - PENDING_MAX_AGE)
+                evict_cache()
+                last_housekeeping = time.time()
+            if time.time() - last_retention >= RETENTION_INTERVAL:
+                run_retention()
+                last_retention = time.time()
+            next_poll = get_next_feed_poll()
+            if next_poll is not None:
+                wait_time = min(max(next_poll - time.time(), 1), POLL_INTERVAL)
+        except Exception as exc:
+            logger.error("Ошибка опроса RSS: %s", exc)
+        poll_event.wait(wait_time)
+        poll_event.clear()
+
+
+def _push(channel_id: str, next_due: float) -> None:
+    _next_due[channel_id] = next_due
+    heapq.heappush(_schedule_heap, (next_due, channel_id))
+
+
+def load_schedule() -> None:
+    """Rebuild the in-memory heap from the ``schedule`` table."""
+    ensure_schedules(posting_interval, time.time())
+    with _schedule_lock:
+        _schedule_heap.clear()
+        _next_due.clear()
+        _intervals.clear()
+        _starved.clear()
+        for channel_id, interval, next_due, _ in get_schedules():
+            _intervals[channel_id] = interval
+            _push(channel_id, next_due)
+    next_post_event.set()
+
+
+def channel_interval(channel_id: str) -> int:
+    return _intervals.get(channel_id, posting_interval)
+
+
+def schedule_channel(channel_id: str) -> None:
+    """Start posting to a newly linked channel with the default feeds and interval.
+
+    Call it only for channels that were not linked before, so sources the
+    admins removed are not subscribed again.
+    """
+    now = time.time()
+    subscribe(channel_id, RSS_URLS)
+    add_schedule(channel_id, posting_interval, now)
+    with _schedule_lock:
+        if channel_id not in _next_due:
+            _intervals[channel_id] = posting_interval
+            _push(channel_id, now)
+    next_post_event.set()
+
+
+def set_channel_interval(channel_id: str, seconds: int) -> None:
+    """Change the interval of one channel, counting from its last post."""
+    now = time.time()
+    row = get_schedule(channel_id)
+    last_post = row[2] if row else None
+    next_due = max(now, last_post + seconds) if last_post else now
+    set_schedule_interval(channel_id, seconds, next_due)
+    with _schedule_lock:
+        _intervals[channel_id] = seconds
+        _push(channel_id, next_due)
+    next_post_event.set()
+
+
+def post_now(channel_id: str) -> None:
+    """Make ``channel_id`` due immediately."""
+    now = time.time()
+    update_schedules([(channel_id, now, None)])
+    with _schedule_lock:
+        _push(channel_id, now)
+    next_post_event.set()
+
+
+def _reschedule(delays: dict, posted: set, now: float) -> None:
+    update_schedules([
+        (channel_id, now + delay, now if channel_id in posted else None)
+        for channel_id, delay in delays.items()
+    ])
+    with _schedule_lock:
+        for channel_id, delay in delays.items():
+            _push(channel_id, now + delay)
+
+
+def _wake_starved() -> None:
+    with _schedule_lock:
+        starved = list(_starved)
+        _starved.clear()
+    if starved:
+        now = time.time()
+        _reschedule(dict.fromkeys(starved, 0), set(), now)
+        next_post_event.set()
+
+
+def _pop_due(now: float) -> list:
+    """Pop the channels due at ``now``, skipping superseded heap entries."""
+    due = []
+    with _schedule_lock:
+        while _schedule_heap and _schedule_heap[0][0] <= now:
+            next_due, channel_id = heapq.heappop(_schedule_heap)
+            if _next_due.get(channel_id) == next_due:
+                del _next_due[channel_id]
+                due.append(channel_id)
+    return due
+
+
+def _time_to_next(now: float):
+    """Seconds until the earliest deadline, or ``None`` with nothing scheduled."""
+    with _schedule_lock:
+        while _schedule_heap and _next_due.get(_schedule_heap[0][1]) != _schedule_heap[0][0]:
+            heapq.heappop(_schedule_heap)
+        if not _schedule_heap:
+            return None
+        return max(0.0, _schedule_heap[0][0] - now)
+
+
+def skip_next(channel_id: str) -> bool:
+    """Skip the next queued entry for ``channel_id``. Returns False if there is none."""
+    items = peek_pending(channel_id, 1)
+    if not items:
+        return False
+    record_deliveries([(channel_id, items[0][0])])
+    return True
+
+
+def run_posting_cycle(channel_ids=None) -> dict:
+    """Post the next undelivered entry to each of ``channel_ids`` (all channels by default).
+
+    Channels due together that share their next entry get it from a single
+    LLM call. Reschedules every channel and returns its delay in seconds.
+    """
+    if channel_ids is None:
+        channel_ids = get_channels()
+    logger.info("Начало цикла постинга, каналов: %s", len(channel_ids))
+    now = time.time()
+    delays = {}
+    groups = {}
+    lookahead = []
+    for channel_id in channel_ids:
+        delays[channel_id] = channel_interval(channel_id)
+        items = peek_pending(channel_id, LLM_BATCH_SIZE)
+        if not items:
+            with _schedule_lock:
+                _starved.add(channel_id)
             continue
+        link, _, rss_url = items[0]
+        groups.setdefault(link, (rss_url, []))[1].append(channel_id)
+        lookahead.extend(item[0] for item in items[1:])
+    if not groups:
+        logger.info("Очередь новостей пуста")
+        _reschedule(delays, set(), now)
+        return delays
 
-        rss_url = RSS_URLS[current_index]
+    # Lookahead slots go to upcoming entries that are not summarized yet.
+    extra = []
+    for link in dict.fromkeys(lookahead):
+        if len(extra) >= LLM_BATCH_SIZE - 1:
+            break
+        if link not in groups and not cached_summary(link):
+            extra.append(link)
+    summaries = summarize_many(list(groups) + extra)
+    posted = set()
+    deliveries = []
+    for link, (rss_url, group) in groups.items():
         logger.info("Обрабатываем RSS: %s", rss_url)
-        feed = feedparser.parse(rss_url)
+        title, summary = summaries[link]
+        if "Ошибка" in title:
+            ERRORS.inc(stage="llm")
+            logger.error("Ошибка обработки новости: %s", title)
+            mark_pending_failed(link, MAX_POST_ATTEMPTS)
+            for channel_id in group:
+                delays[channel_id] = min(ERROR_RETRY_DELAY, delays[channel_id])
+            continue
 
-        if not feed.entries:
-            logger.warning("Нет записей в %s", rss_url)
-            error_count += 1
-        else:
-            latest_entry = feed.entries[0]
-            link = latest_entry.link
-            logger.info("Проверяем ссылку: %s", link)
-            if not check_duplicate(link):
-                title, summary = get_article_content(link)
-                if "Ошибка" in title:
-                    error_count += 1
-                    logger.error("Ошибка обработки новости: %s", title)
-                    continue
-                message = f"<b>{title}</b> <a href='{link}'>| Источник</a>\n{summary}\n\n<i>Пост сгенерирован ИИ</i>"
-                logger.info("Сформировано сообщение: %s", message[:50])
-                for (channel_id,) in channels:
-                    if can_post_to_channel(channel_id):
-                        if send_message(channel_id, message, use_html=True):
-                            save_to_feedcache(title, summary, link, rss_url.split('/')[2])
-                            post_count += 1
-                            last_post_time = time.time()
-                            logger.info("Новость успешно запощена в %s", channel_id)
-                        else:
-                            error_count += 1
-                            logger.error("Не удалось запостить в %s", channel_id)
-                    else:
-                        error_count += 1
-                        logger.error("Нет прав для постинга в %s", channel_id)
+        message = f"<b>{title}</b> <a href='{link}'>| Источник</a>\n{summary}\n\n<i>Пост сгенерирован ИИ</i>"
+        logger.info("Сформировано сообщение: %s", message[:50])
+        allowed = []
+        for channel_id, can_post in check_channels(group).items():
+            if can_post:
+                allowed.append(channel_id)
+            else:
+                ERRORS.inc(stage="permission")
+                logger.error("Нет прав для постинга в %s", channel_id)
+        sent_any = False
+        for channel_id, sent in send_to_channels(allowed, message, use_html=True).items():
+            if sent:
+                sent_any = True
+                posted.add(channel_id)
+                deliveries.append((channel_id, link))
+                POSTS.inc()
+                logger.info("Новость успешно запощена в %s", channel_id)
             else:
-                duplicate_count += 1
-                logger.info("Дубль пропущен: %s, общее число дублей: %s", link, duplicate_count)
+                ERRORS.inc(stage="send")
+                logger.error("Не удалось запостить в %s", channel_id)
+        if sent_any:
+            save_to_feedcache(title, summary, link, rss_url.split('/')[2])
+    record_deliveries(deliveries)
+    _reschedule(delays, posted, now)
+    return delays
 
-        current_index = (current_index + 1) % len(RSS_URLS)
-        logger.info("Ожидание следующего поста (%s сек)", posting_interval)
-        next_post_event.wait(posting_interval)
-        next_post_event.clear()
-        if not posting_active:
+
+def _retry_later(channel_ids) -> None:
+    """Put channels whose cycle failed back on the heap after ERROR_RETRY_DELAY."""
+    next_due = time.time() + ERROR_RETRY_DELAY
+    try:
+        update_schedules([(channel_id, next_due, None) for channel_id in channel_ids])
+    except Exception as exc:
+        logger.error("Не удалось сохранить расписание: %s", exc)
+    with _schedule_lock:
+        for channel_id in channel_ids:
+            _push(channel_id, next_due)
+
+
+def post_news():
+    """Dispatcher: sleep until the earliest channel deadline, then post to every due channel."""
+    while posting_active:
+        try:
+            load_schedule()
             break
+        except Exception as exc:
+            logger.error("Ошибка загрузки расписания: %s", exc)
+            next_post_event.wait(ERROR_RETRY_DELAY)
+            next_post_event.clear()
+    while posting_active:
+        due = _pop_due(time.time())
+        if due:
+            try:
+                run_posting_cycle(due)
+            except Exception as exc:
+                ERRORS.inc(stage="cycle")
+                logger.exception("Ошибка цикла постинга: %s", exc)
+                _retry_later(due)
+            continue
+        wait_time = _time_to_next(time.time())
+        logger.info("Ожидание следующего поста (%s сек)", wait_time)
+        next_post_event.wait(wait_time)
+        next_post_event.clear()
 
 
 def start_posting_thread():
-    global posting_thread, posting_active, start_time
+    global posting_thread, polling_thread, posting_active, start_time
     if posting_thread is None or not posting_thread.is_alive():
         posting_active = True
         start_time = time.time()
+        poll_event.clear()
+        polling_thread = threading.Thread(target=poll_loop)
+        polling_thread.start()
         posting_thread = threading.Thread(target=post_news)
         posting_thread.start()
         logger.info("Постинг запущен")
@@ -131,31 +627,54 @@ def start_posting_thread():
 
 
 def stop_posting_thread():
-    global posting_active, posting_thread
+    global posting_active, posting_thread, polling_thread
     posting_active = False
     next_post_event.set()
+    poll_event.set()
     if posting_thread:
         posting_thread.join()
         posting_thread = None
+    if polling_thread:
+        polling_thread.join()
+        polling_thread = None
     logger.info("Постинг остановлен")
 
 
+def format_feed_health(rows, now: float) -> str:
+    lines = []
+    for url, failures, last_error, latency, circuit, open_until in rows:
+        host = url.split('/')[2] if '//' in url else url
+        speed = f", {latency:.2f} с" if latency is not None else ""
+        error = f" ({html.escape(last_error)})" if last_error else ""
+        if circuit == "open" and open_until and open_until > now:
+            until = datetime.fromtimestamp(open_until).strftime("%d.%m %H:%M")
+            lines.append(f"{host}: отключён до {until}, ошибок подряд {failures}{error}")
+        elif circuit == "open":
+            lines.append(f"{host}: ожидает пробного запроса, ошибок подряд {failures}{error}")
+        elif failures:
+            lines.append(f"{host}: ошибок подряд {failures}{error}{speed}")
+        else:
+            lines.append(f"{host}: OK{speed}")
+    return "\n".join(lines) if lines else "Нет"
+
+
 def get_status(username: str) -> str:
     channel_id = get_channel_by_admin(username)
     uptime = timedelta(seconds=int(time.time() - start_time)) if start_time else "Не запущен"
+    schedule = get_schedule(channel_id) if channel_id else None
+    interval = schedule[0] if schedule else posting_interval
     next_post = "Не активно"
-    if posting_active and last_post_time:
-        time_since_last = time.time() - last_post_time
-        time_to_next = posting_interval - (time_since_last % posting_interval)
+    if posting_active and schedule:
+        time_to_next = max(0.0, schedule[1] - time.time())
         next_post = f"{int(time_to_next // 60)} мин {int(time_to_next % 60)} сек"
-    interval_str = f"{posting_interval // 3600}h {((posting_interval % 3600) // 60)}m" if posting_interval >= 3600 else f"{posting_interval // 60}m"
+    interval_str = f"{interval // 3600}h {((interval % 3600) // 60)}m" if interval >= 3600 else f"{interval // 60}m"
     admins = get_admins(channel_id) if channel_id else []
     creator = get_channel_creator(channel_id) if channel_id else "Неизвестен"
-    current_rss = RSS_URLS[current_index] if current_index < len(RSS_URLS) else "Нет"
+    next_items = peek_pending(channel_id, 1) if channel_id else []
+    next_rss = next_items[0][2] if next_items else "Нет"
     prompt = get_prompt()
     current_model = get_model()
-    with sqlite3.connect(DB_FILE) as conn:
-        feedcache_size = conn.execute("SELECT COUNT(*) FROM feedcache").fetchone()[0]
+    feedcache_size = get_feedcache_size()
     return f"""Статус бота:
 Канал: {channel_id}
 Создатель: @{creator}
@@ -163,11 +682,14 @@ def get_status(username: str) -> str:
 Состояние постинга: {'Активен' if posting_active else 'Остановлен'}
 Текущий интервал: {interval_str}
 Время до следующего поста: {next_post}
-Текущий RSS: {current_rss}
-Всего RSS-источников: {len(RSS_URLS)}
-Запощенных постов: {post_count}
-Пропущено дублей: {duplicate_count}
-Ошибок: {error_count}
+Следующий RSS: {next_rss}
+Новостей в очереди: {get_pending_count(channel_id) if channel_id else 0}
+Запощенных постов: {int(POSTS.value())}
+Пропущено дублей: {int(DUPLICATES.value())}
+Похожих новостей из других источников: {int(NEAR_DUPLICATES.value())}
+Ошибок: {int(ERRORS.value())}
+RSS-источники:
+{format_feed_health(get_feed_health(channel_id) if channel_id else [], time.time())}
 Размер кэша: {feedcache_size} записей
 Аптайм: {uptime}
 Текущая модель: {current_model}
@@ -181,9 +703,12 @@ def get_help() -> str:
 /start - Привязать канал или проверить доступ
 /startposting - Начать постинг
 /stopposting - Остановить постинг
-/setinterval <time> - Установить интервал (34m, 1h, 2h 53m)
-/nextpost - Сбросить таймер и запостить
-/skiprss - Пропустить следующий RSS
+/setinterval <time> - Установить интервал канала (34m, 1h, 2h 53m)
+/nextpost - Сбросить таймер канала и запостить
+/skiprss - Пропустить следующую новость в очереди канала
+/addrss <url> - Подписать канал на RSS-источник
+/removerss <url> - Отписать канал от RSS-источника
+/listrss - Показать RSS-источники канала
 /changellm <model> - Сменить модель LLM (например, gpt-4o-mini)
 /editprompt - Изменить промпт для ИИ (отправь после команды)
 /sqlitebackup - Выгрузить базу SQLite в чат
@@ -195,7 +720,7 @@ def get_help() -> str:
 /feedcacheclear - Очистить кэш
 /addadmin <username> - Добавить админа
 /removeadmin <username> - Удалить админа
-/debug - Показать последний сырой ответ LLM
+/debug [url] - Показать сырой ответ LLM из кэша (последний или по ссылке)
 /help - Это сообщение"""
     logger.info("Текст помощи перед отправкой: %s", help_text)
     return help_text
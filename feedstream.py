@@ -0,0 +1,124 @@
+import calendar
+import io
+import logging
+import time
+import xml.etree.ElementTree as ET
+from datetime import datetime, timezone
+from email.utils import parsedate_tz, mktime_tz
+
+import feedparser
+
+logger = logging.getLogger(__name__)
+
+# Feeds list their newest entries first, so a poll only has to read up to the
+# newest entry seen last time (the feed's high-water mark). The document is
+# stream-parsed and every entry element is freed once read; feedparser, which
+# builds the whole tree, is only used for documents that are not well-formed
+# XML.
+ITEM_TAGS = {"item", "entry"}
+# Feeds may move an updated older story back to the top, so an entry older
+# than the high-water mark is skipped; only this many in a row end the scan.
+STALE_ENTRY_LIMIT = 5
+
+
+def _local(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+def _parse_date(value: str):
+    if not value:
+        return None
+    value = value.strip()
+    parsed = parsedate_tz(value)
+    if parsed:
+        return time.gmtime(mktime_tz(parsed))
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return time.gmtime(moment.timestamp())
+
+
+def _entry(element) -> feedparser.FeedParserDict:
+    """Build a feedparser-style entry from an RSS ``item`` or Atom ``entry``."""
+    fields = {}
+    link = None
+    for child in element:
+        name = _local(child.tag)
+        if name == "link":
+            href = child.get("href")
+            if href is None:
+                link = link or (child.text or "").strip()
+            elif child.get("rel", "alternate") == "alternate" and not link:
+                link = href
+        elif name not in fields:
+            fields[name] = (child.text or "").strip()
+    entry = feedparser.FeedParserDict()
+    entry["title"] = fields.get("title", "")
+    entry["summary"] = fields.get("description") or fields.get("summary") or fields.get("content", "")
+    if link:
+        entry["link"] = link
+    entry["id"] = fields.get("guid") or fields.get("id") or link
+    published = _parse_date(fields.get("pubDate") or fields.get("published") or fields.get("date"))
+    updated = _parse_date(fields.get("updated"))
+    if published:
+        entry["published_parsed"] = published
+    if updated:
+        entry["updated_parsed"] = updated
+    return entry
+
+
+def iter_entries(content: bytes):
+    """Yield entries of an RSS 1.0/2.0 or Atom document while it is being parsed."""
+    for _, element in ET.iterparse(io.BytesIO(content), events=("end",)):
+        if _local(element.tag) in ITEM_TAGS:
+            yield _entry(element)
+            element.clear()
+
+
+def entry_timestamp(entry):
+    parsed = entry.get("published_parsed") or entry.get("updated_parsed")
+    return float(calendar.timegm(parsed)) if parsed else None
+
+
+def _take_new(entries, last_guid, last_published) -> list:
+    new = []
+    stale = 0
+    for entry in entries:
+        guid = entry.get("id") or entry.get("link")
+        published = entry_timestamp(entry)
+        if last_guid and guid == last_guid:
+            break
+        if last_published and published is not None and published < last_published:
+            stale += 1
+            if stale >= STALE_ENTRY_LIMIT:
+                break
+            continue
+        stale = 0
+        new.append(entry)
+    return new
+
+
+def new_entries(content: bytes, last_guid: str = None, last_published: float = None) -> list:
+    """Return the entries of ``content`` newer than the high-water mark.
+
+    Parsing stops at the entry that matches ``last_guid`` or after
+    ``STALE_ENTRY_LIMIT`` entries in a row published before ``last_published``;
+    a single older entry is skipped.
+    """
+    try:
+        return _take_new(iter_entries(content), last_guid, last_published)
+    except ET.ParseError as exc:
+        logger.info("RSS не является корректным XML (%s), разбор через feedparser", exc)
+        return _take_new(feedparser.parse(content).entries, last_guid, last_published)
+
+
+def high_water_mark(entries):
+    """Return ``(guid, published)`` to store after ``entries`` were processed."""
+    if not entries:
+        return None
+    first = entries[0]
+    published = [ts for ts in map(entry_timestamp, entries) if ts is not None]
+    return first.get("id") or first.get("link"), max(published) if published else None
@@ -1,13 +1,122 @@
+import hashlib
+import os
 import re
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from openai import OpenAI
+from openai import OpenAI, RateLimitError
 
-from database import get_prompt, get_model, log_error
+from database import (
+    get_prompt,
+    get_model,
+    log_error,
+    get_llm_cache,
+    save_llm_cache,
+    evict_llm_cache,
+    get_llm_raw,
+)
+from extractor import get_article_text, evict_cache as evict_articles
+from ratelimit import TokenBucket
+import metrics
 
 logger = logging.getLogger(__name__)
 
-last_llm_response = None  # store last raw LLM response
+# Account limits; requests wait for capacity instead of running into 429s.
+LLM_RPM = int(os.getenv("LLM_RPM", "60"))
+LLM_TPM = int(os.getenv("LLM_TPM", "60000"))
+LLM_WORKERS = int(os.getenv("LLM_WORKERS", "4"))
+MAX_TOKENS = 500
+RATE_LIMIT_BACKOFF = 2
+# The SDK's own retries are off (see get_client), so timeouts, connection
+# errors and 5xx responses are retried here after ERROR_BACKOFF * 2**attempt.
+ERROR_BACKOFF = 1
+
+# Parsed results are cached by (url, prompt hash, model) so an article that
+# failed to post is not paid for twice.
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+LLM_CACHE_MAX_ROWS = int(os.getenv("LLM_CACHE_MAX_ROWS", "5000"))
+LLM_CACHE = metrics.counter("autonews_llm_cache_total", "LLM cache lookups.", ["result"])
+LLM_REQUEST_SECONDS = metrics.histogram(
+    "autonews_llm_request_seconds",
+    "OpenAI completion time per model and attempt.",
+    ["model", "attempt", "outcome"],
+)
+
+# Used when a custom prompt has no {text} placeholder or the page could not
+# be extracted.
+ARTICLE_SUFFIX = "\n\nТекст статьи:\n{text}"
+ARTICLE_UNAVAILABLE = "Текст статьи недоступен, используй статью по ссылке."
+
+_client = None
+_client_lock = threading.Lock()
+_request_bucket = TokenBucket(LLM_RPM / 60, LLM_RPM)
+_token_bucket = TokenBucket(LLM_TPM / 60, LLM_TPM)
+_llm_executor = ThreadPoolExecutor(max_workers=LLM_WORKERS, thread_name_prefix="llm")
+
+
+def get_client() -> OpenAI:
+    """Return the shared OpenAI client so its HTTP connections are reused."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                # Retries and 429 backoff are handled in get_article_content.
+                _client = OpenAI(max_retries=0)
+    return _client
+
+
+def _wait_for_capacity(prompt: str) -> None:
+    _request_bucket.acquire()
+    # Rough token estimate: ~4 characters per token plus the completion budget.
+    _token_bucket.acquire(len(prompt) / 4 + MAX_TOKENS)
+
+
+def _retry_after(exc: RateLimitError, attempt: int) -> float:
+    header = exc.response.headers.get("retry-after") if exc.response is not None else None
+    try:
+        return float(header)
+    except (TypeError, ValueError):
+        return RATE_LIMIT_BACKOFF * 2 ** attempt
+
+
+def prompt_hash(prompt: str) -> str:
+    return hashlib.sha256(prompt.encode()).hexdigest()[:16]
+
+
+def cached_summary(url: str):
+    """Return the cached ``(title, summary)`` for ``url`` with the current prompt and model."""
+    return get_llm_cache(url, prompt_hash(get_prompt()), get_model(), time.time() - LLM_CACHE_TTL)
+
+
+def evict_cache() -> int:
+    """Drop expired LLM responses and extracted article texts."""
+    return evict_llm_cache(time.time() - LLM_CACHE_TTL, LLM_CACHE_MAX_ROWS) + evict_articles()
+
+
+def build_prompt(template: str, url: str, text: str | None) -> str:
+    """Fill the prompt template; the article text is appended if the template has no ``{text}``."""
+    if text is None:
+        text = ARTICLE_UNAVAILABLE
+    elif "{text}" not in template:
+        template += ARTICLE_SUFFIX
+    return template.format(url=url, text=text)
+
+
+def get_debug_response(url: str = None):
+    """Return the raw cached LLM response for ``url`` (or the latest one) for /debug."""
+    row = get_llm_raw(url)
+    if not row:
+        return None
+    link, raw, created = row
+    return {
+        "response": raw,
+        "link": link,
+        "timestamp": datetime.fromtimestamp(created).isoformat(),
+        "cache_hits": int(LLM_CACHE.value(result="hit")),
+        "cache_misses": int(LLM_CACHE.value(result="miss")),
+    }
 
 
 def is_valid_language(text: str) -> bool:
@@ -19,27 +128,32 @@ def clean_title(title: str) -> str:
 
 
 def get_article_content(url: str, max_attempts: int = 3):
-    global last_llm_response
-    client = OpenAI()
-    prompt = get_prompt().format(url=url)
+    template = get_prompt()
     model = get_model()
+    key = prompt_hash(template)
+    cached = get_llm_cache(url, key, model, time.time() - LLM_CACHE_TTL)
+    if cached:
+        LLM_CACHE.inc(result="hit")
+        logger.info("Ответ LLM для %s взят из кэша", url)
+        return cached
+    LLM_CACHE.inc(result="miss")
+    client = get_client()
+    prompt = build_prompt(template, url, get_article_text(url))
 
     for attempt in range(max_attempts):
         logger.info("Запрос к OpenAI для %s, попытка %s, модель: %s", url, attempt + 1, model)
         try:
-            response = client.chat.completions.create(
-                model=model,
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.7,
-                max_tokens=500
-            )
+            _wait_for_capacity(prompt)
+            with LLM_REQUEST_SECONDS.time(model=model, attempt=attempt + 1, outcome="error") as labels:
+                response = client.chat.completions.create(
+                    model=model,
+                    messages=[{"role": "user", "content": prompt}],
+                    temperature=0.7,
+                    max_tokens=MAX_TOKENS
+                )
+                labels["outcome"] = "ok"
             content = response.choices[0].message.content.strip()
             logger.info("Сырой ответ LLM: %s", content)
-            last_llm_response = {
-                "response": content,
-                "link": url,
-                "timestamp": datetime.now().isoformat()
-            }
             title, summary = None, None
             if "\n" in content:
                 title, summary = content.split("\n", 1)
@@ -58,12 +172,26 @@ def get_article_content(url: str, max_attempts: int = 3):
                 cleaned_title = cleaned_title[:97] + "..."
                 logger.warning("Заголовок укорочен: %s", cleaned_title)
             if is_valid_language(cleaned_title):
+                save_llm_cache(url, key, model, cleaned_title, summary, content)
                 return cleaned_title, summary
             logger.warning("Недопустимый язык в заголовке после очистки: %s", cleaned_title)
             log_error(f"Недопустимый язык в заголовке: {cleaned_title}", url)
+        except RateLimitError as e:
+            delay = _retry_after(e, attempt)
+            logger.warning("Лимит OpenAI (429) для %s, повтор через %s сек", url, delay)
+            if attempt == max_attempts - 1:
+                log_error(f"Лимит запросов OpenAI: {str(e)}", url)
+                return "Ошибка: Не удалось обработать новость", "Ошибка"
+            time.sleep(delay)
         except Exception as e:
             logger.error("Ошибка запроса к OpenAI: %s", str(e))
             log_error(f"Ошибка запроса к OpenAI: {str(e)}", url)
             if attempt == max_attempts - 1:
                 return "Ошибка: Не удалось обработать новость", "Ошибка"
+            time.sleep(ERROR_BACKOFF * 2 ** attempt)
     return "Ошибка: Не удалось обработать новость", "Ошибка"
+
+
+def summarize_many(urls):
+    """Summarize ``urls`` concurrently and return ``{url: (title, summary)}``."""
+    return dict(zip(urls, _llm_executor.map(get_article_content, urls)))
@@ -0,0 +1,98 @@
+import hashlib
+import re
+import threading
+from collections import Counter, deque
+
+BITS = 64
+MASK = (1 << BITS) - 1
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were will with "
+    "new now how why what you your after over into out up".split()
+)
+_TAG = re.compile(r"<[^>]+>")
+_WORD = re.compile(r"\w+")
+
+
+def normalize(text: str) -> list:
+    """Lowercase words of ``text`` without markup and stop words."""
+    words = _WORD.findall(_TAG.sub(" ", text or "").lower())
+    return [word for word in words if word not in STOPWORDS]
+
+
+def _hash(feature: str) -> int:
+    return int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), "big")
+
+
+def simhash(text: str) -> int:
+    """64-bit SimHash over the words of ``text``, weighted by frequency."""
+    features = Counter(normalize(text))
+    weights = [0] * BITS
+    for feature, count in features.items():
+        h = _hash(feature)
+        for bit in range(BITS):
+            weights[bit] += count if h >> bit & 1 else -count
+    return sum(1 << bit for bit in range(BITS) if weights[bit] > 0)
+
+
+def distance(a: int, b: int) -> int:
+    return ((a ^ b) & MASK).bit_count()
+
+
+class SimHashIndex:
+    """Sliding-window LSH index of SimHash fingerprints.
+
+    A fingerprint is split into ``bands`` equal bit ranges and filed under
+    each of them; any two fingerprints within ``max_distance < bands`` bits
+    share at least one band, so a lookup only compares a handful of
+    candidates. Entries older than ``window`` seconds are dropped. Each
+    entry carries its source, and a lookup ignores entries from its own
+    source: stories from one feed are distinct even when their wording is
+    close (e.g. consecutive release notes).
+    """
+
+    def __init__(self, window: float, bands: int = 8, max_distance: int = 7):
+        self.window = window
+        self.bands = bands
+        self.max_distance = max_distance
+        self._width = BITS // bands
+        self._buckets = {}
+        self._entries = deque()
+        self._lock = threading.Lock()
+
+    def _keys(self, fingerprint: int):
+        band_mask = (1 << self._width) - 1
+        return [(band, fingerprint >> (band * self._width) & band_mask) for band in range(self.bands)]
+
+    def _expire(self, now: float) -> None:
+        while self._entries and self._entries[0][0] < now - self.window:
+            _, item_id, fingerprint = self._entries.popleft()
+            for key in self._keys(fingerprint):
+                bucket = self._buckets.get(key)
+                if bucket:
+                    bucket.pop(item_id, None)
+                    if not bucket:
+                        del self._buckets[key]
+
+    def add(self, item_id: str, fingerprint: int, timestamp: float, source: str = None) -> None:
+        """File ``item_id``; timestamps are expected in roughly increasing order."""
+        with self._lock:
+            self._entries.append((timestamp, item_id, fingerprint))
+            for key in self._keys(fingerprint):
+                self._buckets.setdefault(key, {})[item_id] = (fingerprint, source)
+
+    def find(self, fingerprint: int, now: float, source: str = None):
+        """Return the id of the closest near-duplicate from another source, or ``None``."""
+        with self._lock:
+            self._expire(now)
+            best, best_distance = None, self.max_distance + 1
+            for key in self._keys(fingerprint):
+                for item_id, (other, other_source) in self._buckets.get(key, {}).items():
+                    if source is not None and other_source == source:
+                        continue
+                    d = distance(fingerprint, other)
+                    if d < best_distance:
+                        best, best_distance = item_id, d
+            return best
+
+    def __len__(self):
+        return len(self._entries)
@@ -1,10 +1,49 @@
 import os
+import heapq
+import itertools
 import json
 import requests
 import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+
+from ratelimit import TokenBucket
+import metrics
 
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
-TELEGRAM_URL = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/" if TELEGRAM_TOKEN else None
+# Overridable so the bot can be pointed at a local Bot API server or a stub.
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org").rstrip("/")
+TELEGRAM_URL = f"{TELEGRAM_API_URL}/bot{TELEGRAM_TOKEN}/" if TELEGRAM_TOKEN else None
+
+# Concurrent requests when one message goes out to many channels.
+FANOUT_WORKERS = int(os.getenv("TELEGRAM_FANOUT_WORKERS", "16"))
+
+# Outbound sendMessage limits: Telegram allows about 30 messages per second
+# overall and roughly one per second to the same chat.
+GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))
+CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))
+SEND_WORKERS = int(os.getenv("TELEGRAM_SEND_WORKERS", "8"))
+SEND_MAX_RETRIES = 5
+
+# One keep-alive session for every Bot API call, so requests reuse pooled
+# TLS connections to api.telegram.org instead of opening a new one each time.
+session = requests.Session()
+_adapter = HTTPAdapter(pool_connections=2, pool_maxsize=max(FANOUT_WORKERS, SEND_WORKERS))
+session.mount("https://", _adapter)
+session.mount("http://", _adapter)
+_fanout_executor = ThreadPoolExecutor(max_workers=FANOUT_WORKERS, thread_name_prefix="tg-fanout")
+
+# Cached getChatMember answers: channel_id -> (allowed, expires_at).
+PERMISSION_TTL = int(os.getenv("TELEGRAM_PERMISSION_TTL", "3600"))
+PERMISSION_NEGATIVE_TTL = int(os.getenv("TELEGRAM_PERMISSION_NEGATIVE_TTL", "300"))
+_permissions = {}
+_permissions_lock = threading.Lock()
+
+TELEGRAM_REQUEST_SECONDS = metrics.histogram(
+    "autonews_telegram_request_seconds", "Bot API call time.", ["method", "status"]
+)
 
 _bot_id = None
 
@@ -20,7 +59,7 @@ def get_bot_id():
         logger.error("TELEGRAM_TOKEN не задан")
         return None
     try:
-        response = requests.get(f"{TELEGRAM_URL}getMe", timeout=10)
+        response = session.get(f"{TELEGRAM_URL}getMe", timeout=10)
         if response.status_code != 200:
             logger.error("Ошибка getMe: %s", response.text)
             return None
@@ -31,10 +70,126 @@ def get_bot_id():
     return _bot_id
 
 
-def send_message(chat_id, text, reply_markup=None, use_html=True):
+def _post_message(payload):
+    """Call sendMessage once. Returns ``(sent, retry_after)``.
+
+    ``retry_after`` is set only when Telegram answered 429.
+    """
+    try:
+        with TELEGRAM_REQUEST_SECONDS.time(method="sendMessage", status="error") as labels:
+            response = session.post(
+                f"{TELEGRAM_URL}sendMessage", json=payload, timeout=10
+            )
+            labels["status"] = str(response.status_code)
+        if response.status_code == 429:
+            try:
+                retry_after = response.json().get("parameters", {}).get("retry_after", 1)
+            except ValueError:
+                retry_after = 1
+            logger.warning("Лимит Telegram для %s, повтор через %s сек", payload["chat_id"], retry_after)
+            return False, float(retry_after)
+        if response.status_code != 200:
+            logger.error("Ошибка отправки: %s", response.text)
+            if response.status_code == 403:
+                invalidate_permission(payload["chat_id"])
+            return False, None
+    except requests.RequestException as exc:
+        logger.error("Ошибка отправки: %s", exc)
+        return False, None
+    logger.info("Сообщение успешно отправлено")
+    return True, None
+
+
+class SendQueue:
+    """Outbound message queue paced by a global and a per-chat token bucket.
+
+    Messages wait in a heap ordered by the time they may go out, so a chat
+    held back by its bucket or by a 429 ``retry_after`` does not delay the
+    others. Each enqueued message gets a Future resolved with True/False.
+    """
+
+    def __init__(self, sender, workers, global_rate, chat_rate, max_retries=SEND_MAX_RETRIES):
+        self._sender = sender
+        self._workers = workers
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chat_rate = chat_rate
+        self._chat_buckets = {}
+        self._max_retries = max_retries
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._threads = []
+
+    def _start(self):
+        if not self._threads:
+            for i in range(self._workers):
+                thread = threading.Thread(target=self._run, name=f"tg-send-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _push(self, ready_at, item):
+        with self._cond:
+            heapq.heappush(self._heap, (ready_at, next(self._seq), item))
+            self._cond.notify()
+
+    def enqueue(self, payload, callback=None) -> Future:
+        future = Future()
+        if callback:
+            future.add_done_callback(lambda f: callback(f.result()))
+        with self._cond:
+            self._start()
+        self._push(time.monotonic(), {"payload": payload, "future": future, "attempts": 0})
+        return future
+
+    def _chat_bucket(self, chat_id):
+        with self._cond:
+            bucket = self._chat_buckets.get(chat_id)
+            if bucket is None:
+                bucket = self._chat_buckets[chat_id] = TokenBucket(self._chat_rate, 1)
+            return bucket
+
+    def _next_item(self):
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if self._heap and self._heap[0][0] <= now:
+                    return heapq.heappop(self._heap)[2]
+                self._cond.wait(self._heap[0][0] - now if self._heap else None)
+
+    def _run(self):
+        while True:
+            item = self._next_item()
+            payload = item["payload"]
+            delay = self._chat_bucket(str(payload["chat_id"])).try_acquire()
+            if delay:
+                self._push(time.monotonic() + delay, item)
+                continue
+            self._global.acquire()
+            try:
+                sent, retry_after = self._sender(payload)
+            except Exception as exc:
+                logger.error("Ошибка отправки: %s", exc)
+                sent, retry_after = False, None
+            if retry_after is not None and item["attempts"] < self._max_retries:
+                item["attempts"] += 1
+                self._push(time.monotonic() + retry_after, item)
+                continue
+            item["future"].set_result(sent)
+
+
+_send_queue = SendQueue(_post_message, SEND_WORKERS, GLOBAL_RATE, CHAT_RATE)
+
+
+def send_message_async(chat_id, text, reply_markup=None, use_html=True, callback=None):
+    """Queue a message and return a Future resolved with True/False on delivery.
+
+    ``callback``, if given, is called with the same result.
+    """
     if not TELEGRAM_TOKEN:
         logger.error("TELEGRAM_TOKEN не задан")
-        return False
+        future = Future()
+        future.set_result(False)
+        return future
     if len(text) > 4096:
         text = text[:4093] + "..."
         logger.warning("Сообщение обрезано до 4096 символов для chat_id %s", chat_id)
@@ -47,18 +202,11 @@ def send_message(chat_id, text, reply_markup=None, use_html=True):
     if reply_markup:
         payload["reply_markup"] = json.dumps(reply_markup)
     logger.info("Отправка сообщения в %s: %s", chat_id, text[:50])
-    try:
-        response = requests.post(
-            f"{TELEGRAM_URL}sendMessage", json=payload, timeout=10
-        )
-        if response.status_code != 200:
-            logger.error("Ошибка отправки: %s", response.text)
-            return False
-    except requests.RequestException as exc:
-        logger.error("Ошибка отправки: %s", exc)
-        return False
-    logger.info("Сообщение успешно отправлено")
-    return True
+    return _send_queue.enqueue(payload, callback)
+
+
+def send_message(chat_id, text, reply_markup=None, use_html=True):
+    return send_message_async(chat_id, text, reply_markup, use_html).result()
 
 
 def send_file(chat_id, file_path):
@@ -68,11 +216,11 @@ def send_file(chat_id, file_path):
     try:
         with open(file_path, "rb") as f:
             files = {"document": (os.path.basename(file_path), f)}
-            response = requests.post(
+            response = session.post(
                 f"{TELEGRAM_URL}sendDocument",
                 data={"chat_id": chat_id},
                 files=files,
-                timeout=10,
+                timeout=60,
             )
         if response.status_code != 200:
             logger.error("Ошибка отправки файла: %s", response.text)
@@ -84,16 +232,50 @@ def send_file(chat_id, file_path):
     return True
 
 
-def can_post_to_channel(channel_id):
+def download_file(file_id, dest_path):
+    """Stream a file sent to the bot into ``dest_path`` without buffering it in memory."""
+    if not TELEGRAM_TOKEN:
+        logger.error("TELEGRAM_TOKEN не задан")
+        return False
+    try:
+        response = session.get(f"{TELEGRAM_URL}getFile", params={"file_id": file_id}, timeout=10)
+        if response.status_code != 200:
+            logger.error("Ошибка запроса getFile: %s", response.text)
+            return False
+        file_path = response.json().get("result", {}).get("file_path")
+        if not file_path:
+            logger.error("getFile не вернул file_path для %s", file_id)
+            return False
+        with session.get(
+            f"{TELEGRAM_API_URL}/file/bot{TELEGRAM_TOKEN}/{file_path}",
+            stream=True,
+            timeout=30,
+        ) as file_resp:
+            if file_resp.status_code != 200:
+                logger.error("Ошибка скачивания файла: %s", file_resp.status_code)
+                return False
+            with open(dest_path, "wb") as f:
+                for chunk in file_resp.iter_content(chunk_size=1 << 16):
+                    f.write(chunk)
+    except (IOError, requests.RequestException) as exc:
+        logger.error("Ошибка скачивания файла: %s", exc)
+        return False
+    return True
+
+
+def _fetch_post_rights(channel_id):
+    """Ask getChatMember whether the bot may post; ``None`` if the request failed."""
     bot_id = get_bot_id()
     if not bot_id:
-        return False
+        return None
     try:
-        response = requests.get(
-            f"{TELEGRAM_URL}getChatMember",
-            params={"chat_id": channel_id, "user_id": bot_id},
-            timeout=10,
-        )
+        with TELEGRAM_REQUEST_SECONDS.time(method="getChatMember", status="error") as labels:
+            response = session.get(
+                f"{TELEGRAM_URL}getChatMember",
+                params={"chat_id": channel_id, "user_id": bot_id},
+                timeout=10,
+            )
+            labels["status"] = str(response.status_code)
         if response.status_code != 200:
             logger.error("Ошибка проверки прав для %s: %s", channel_id, response.text)
             return False
@@ -101,4 +283,55 @@ def can_post_to_channel(channel_id):
         return status in ["administrator", "creator"]
     except requests.RequestException as exc:
         logger.error("Ошибка проверки прав для %s: %s", channel_id, exc)
+        return None
+
+
+def can_post_to_channel(channel_id, use_cache=True):
+    """Return whether the bot is an admin of ``channel_id``.
+
+    Answers are cached for ``PERMISSION_TTL`` seconds (``PERMISSION_NEGATIVE_TTL``
+    for refusals); failed requests are not cached.
+    """
+    key = str(channel_id)
+    now = time.monotonic()
+    if use_cache:
+        with _permissions_lock:
+            cached = _permissions.get(key)
+        if cached and cached[1] > now:
+            return cached[0]
+    allowed = _fetch_post_rights(channel_id)
+    if allowed is None:
         return False
+    ttl = PERMISSION_TTL if allowed else PERMISSION_NEGATIVE_TTL
+    with _permissions_lock:
+        _permissions[key] = (allowed, now + ttl)
+    return allowed
+
+
+def invalidate_permission(channel_id):
+    with _permissions_lock:
+        _permissions.pop(str(channel_id), None)
+
+
+def refresh_permissions(channel_ids):
+    """Re-check posting rights for all channels concurrently, bypassing the cache."""
+    channel_ids = list(channel_ids)
+    results = _fanout_executor.map(
+        lambda channel_id: can_post_to_channel(channel_id, use_cache=False), channel_ids
+    )
+    return dict(zip(channel_ids, results))
+
+
+def check_channels(channel_ids):
+    """Check posting rights for all channels concurrently; returns ``{channel_id: bool}``."""
+    channel_ids = list(channel_ids)
+    return dict(zip(channel_ids, _fanout_executor.map(can_post_to_channel, channel_ids)))
+
+
+def send_to_channels(channel_ids, text, use_html=True):
+    """Send ``text`` to all channels through the send queue; returns ``{channel_id: bool}``."""
+    futures = {
+        channel_id: send_message_async(channel_id, text, use_html=use_html)
+        for channel_id in channel_ids
+    }
+    return {channel_id: future.result() for channel_id, future in futures.items()}
@@ -0,0 +1,18 @@
+import sys
+from pathlib import Path
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import database as db
+
+
+@pytest.fixture
+def temp_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "DB_FILE", str(tmp_path / "feedcache.db"))
+    db.invalidate_config()
+    db.init_db()
+    yield
+    db.close_connection()
+    db.invalidate_config()
+    db.invalidate_dedup_index()
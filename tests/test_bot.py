@@ -0,0 +1,88 @@
+import importlib
+import queue
+import sys
+from pathlib import Path
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import database as db
+
+
+@pytest.fixture
+def bot(temp_db, monkeypatch):
+    module = importlib.import_module("bot")
+    sent = []
+    monkeypatch.setattr(module.tg, "send_message", lambda chat_id, text, **kwargs: sent.append((chat_id, text)))
+    module.sent = sent
+    yield module
+    module.update_queue.join()
+
+
+def message(text, update_id, **extra):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "chat": {"id": 42, "type": "private"},
+            "from": {"username": "admin"},
+            "text": text,
+            **extra,
+        },
+    }
+
+
+def test_redelivered_update_is_handled_once(bot, monkeypatch):
+    handled = []
+    monkeypatch.setattr(bot, "handle_update", lambda update: handled.append(update["update_id"]))
+    client = bot.app.test_client()
+    for _ in range(3):
+        assert client.post("/webhook", json=message("/help", 1001)).status_code == 200
+    assert client.post("/webhook", json=message("/help", 1002)).status_code == 200
+    bot.update_queue.join()
+    assert handled == [1001, 1002]
+
+
+def test_full_queue_answers_503(bot, monkeypatch):
+    full = queue.Queue(maxsize=1)
+    full.put_nowait({})
+    monkeypatch.setattr(bot, "update_queue", full)
+    response = bot.app.test_client().post("/webhook", json=message("/help", 2001))
+    assert response.status_code == 503
+    assert 2001 not in bot._recent_update_set
+    full.get_nowait()
+    full.task_done()
+
+
+def test_commands_dispatch_through_registry(bot, monkeypatch):
+    calls = []
+    monkeypatch.setitem(bot.COMMANDS, "/help", lambda ctx: calls.append(("help", ctx.arg)))
+    monkeypatch.setitem(bot.COMMANDS, "/sqliteupdate", lambda ctx: calls.append(("upload", "document" in ctx.message)))
+    bot.handle_update(message("/help@AutoNewsBot extra words", 3001))
+    upload = message("", 3002, caption="/sqliteupdate", document={"file_id": "f"})
+    del upload["message"]["text"]
+    bot.handle_update(upload)
+    bot.handle_update(message("just chatting", 3003))
+    bot.handle_update(message("/nosuchcommand", 3004))
+    assert calls == [("help", "extra words"), ("upload", True)]
+    assert bot.sent == [(42, "Неизвестная команда. Используйте /help")]
+
+
+def test_plain_messages_are_not_queued(bot, monkeypatch):
+    full = queue.Queue(maxsize=1)
+    full.put_nowait({})
+    monkeypatch.setattr(bot, "update_queue", full)
+    response = bot.app.test_client().post("/webhook", json=message("just chatting", 4001))
+    assert response.status_code == 200
+    assert full.qsize() == 1
+    full.get_nowait()
+    full.task_done()
+
+
+def test_addrss_subscribes_only_checked_feeds(bot, monkeypatch):
+    db.save_channel("-100", "admin")
+    monkeypatch.setattr(bot.feeds, "check_feed", lambda url: None if url.endswith("/rss") else "404")
+    bot.handle_update(message("/addrss https://example.com/missing", 5001))
+    bot.handle_update(message("/addrss https://example.com/rss", 5002))
+    assert db.get_channel_feeds("-100") == ["https://example.com/rss"]
+    assert bot.sent[0] == (42, "RSS не добавлен: 404")
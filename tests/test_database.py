@@ -0,0 +1,238 @@
+import sys
+import threading
+import time
+from pathlib import Path
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import database as db
+
+
+def test_config_defaults(temp_db):
+    config = db.get_config()
+    assert config.model == db.DEFAULT_MODEL
+    assert config.error_notifications is False
+    assert "{url}" in config.prompt
+
+
+def test_config_served_from_cache_until_write(temp_db):
+    assert db.get_model() == db.DEFAULT_MODEL
+    with db.get_connection() as conn:
+        conn.execute("UPDATE config SET value = 'other' WHERE key = 'model'")
+    assert db.get_model() == db.DEFAULT_MODEL
+    db.set_model("gpt-4o")
+    assert db.get_model() == "gpt-4o"
+    db.set_error_notifications("on")
+    assert db.get_error_notifications() is True
+
+
+def test_dedup_index_tracks_feedcache(temp_db):
+    assert db.check_duplicate("https://example.com/a") is False
+    db.save_to_feedcache("t", "s", "https://example.com/a", "example.com")
+    assert db.check_duplicate("https://example.com/a") is True
+    assert db.filter_new_links(
+        ["https://example.com/a", "https://example.com/b"]
+    ) == ["https://example.com/b"]
+    assert db.get_feedcache_size() == 1
+    db.clear_feedcache()
+    assert db.check_duplicate("https://example.com/a") is False
+
+
+def test_dedup_index_preloaded_from_disk(temp_db):
+    db.save_to_feedcache("t", "s", "https://example.com/a", "example.com")
+    db.invalidate_dedup_index()
+    assert db.check_duplicate("https://example.com/a") is True
+
+
+def test_llm_cache_roundtrip_and_eviction(temp_db):
+    db.save_llm_cache("https://example.com/a", "p1", "m", "A", "sa", "raw a")
+    db.save_llm_cache("https://example.com/b", "p1", "m", "B", "sb", "raw b")
+    assert db.get_llm_cache("https://example.com/a", "p1", "m", 0) == ("A", "sa")
+    assert db.get_llm_cache("https://example.com/a", "p2", "m", 0) is None
+    assert db.evict_llm_cache(0, max_rows=1) == 1
+    assert db.get_llm_cache("https://example.com/a", "p1", "m", 0) == ("A", "sa")
+    assert db.get_llm_cache("https://example.com/b", "p1", "m", 0) is None
+    assert db.get_llm_raw()[:2] == ("https://example.com/a", "raw a")
+
+
+def test_backup_and_restore_roundtrip(temp_db, tmp_path):
+    db.save_to_feedcache("t", "s", "https://example.com/a", "example.com")
+    backup = str(tmp_path / "backup.db.gz")
+    db.backup_to_file(backup)
+    db.clear_feedcache()
+    db.set_model("other")
+    db.restore_from_file(backup)
+    assert db.check_duplicate("https://example.com/a") is True
+    assert db.get_model() == db.DEFAULT_MODEL
+
+
+def test_restore_rejects_invalid_file(temp_db, tmp_path):
+    db.save_to_feedcache("t", "s", "https://example.com/a", "example.com")
+    bogus = tmp_path / "bogus.db"
+    bogus.write_bytes(b"not a database" * 100)
+    with pytest.raises(ValueError):
+        db.restore_from_file(str(bogus))
+    assert db.check_duplicate("https://example.com/a") is True
+
+
+def test_restore_rejects_truncated_gzip(temp_db, tmp_path):
+    db.save_to_feedcache("t", "s", "https://example.com/a", "example.com")
+    backup = tmp_path / "backup.db.gz"
+    db.backup_to_file(str(backup))
+    truncated = tmp_path / "truncated.db.gz"
+    truncated.write_bytes(backup.read_bytes()[:-64])
+    with pytest.raises(ValueError):
+        db.restore_from_file(str(truncated))
+    assert not (tmp_path / "truncated.db.gz.unpacked").exists()
+    assert db.check_duplicate("https://example.com/a") is True
+
+
+def test_retention_prunes_by_age_and_count(temp_db, monkeypatch):
+    monkeypatch.setattr(db, "FEEDCACHE_MAX_ROWS", 2)
+    monkeypatch.setattr(db, "RETENTION_BATCH_SIZE", 1)
+    for i in range(4):
+        db.save_to_feedcache("t", "s", f"https://example.com/{i}", "example.com")
+    with db.get_connection() as conn:
+        conn.execute(
+            "UPDATE feedcache SET timestamp = '2000-01-01T00:00:00' WHERE id = ?",
+            (db.link_hash("https://example.com/3"),),
+        )
+    assert db.run_retention() == (2, 0)
+    assert db.get_feedcache_size() == 2
+    assert db.filter_new_links([f"https://example.com/{i}" for i in range(4)]) == [
+        "https://example.com/0",
+        "https://example.com/3",
+    ]
+    assert db.get_connection().execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+
+
+def test_errors_are_buffered_and_digested(temp_db, monkeypatch):
+    sent = []
+    monkeypatch.setattr(db, "send_message_async", lambda chat_id, text, use_html=True: sent.append((chat_id, text)))
+    db.save_channel("@chan", "admin")
+    db.set_error_notifications("on")
+    aggregator = db.ErrorAggregator()
+    aggregator._thread = object()  # keep the background thread out of the test
+    aggregator.add("Ошибка запроса к OpenAI: timeout after 10s", "https://example.com/1")
+    aggregator.add("Ошибка запроса к OpenAI: timeout after 12s", "https://example.com/2")
+    aggregator.add("Недопустимый язык в заголовке: x", "https://example.com/3")
+    aggregator.flush()
+    assert db.get_connection().execute("SELECT COUNT(*) FROM errors").fetchone()[0] == 3
+    aggregator._send_digest()
+    assert len(sent) == 1
+    chat_id, text = sent[0]
+    assert chat_id == "@chan"
+    assert "×2 Ошибка запроса к OpenAI: timeout after 12s" in text
+    assert "×1 Недопустимый язык" in text
+
+
+def test_pending_cursor_is_per_channel(temp_db):
+    now = time.time()
+    db.enqueue_pending([
+        ("https://example.com/a", "Phone launched", "src", now, 1.0, ""),
+        ("https://example.com/b", "Laptop recalled", "src", now - 60, 1.0, ""),
+    ])
+    assert db.peek_pending("-1") == []
+    db.subscribe("-1", ["src"])
+    db.subscribe("-2", ["src"])
+    db.record_deliveries([("-1", "https://example.com/a")])
+    assert db.peek_pending("-1")[0][0] == "https://example.com/b"
+    assert db.peek_pending("-2")[0][0] == "https://example.com/a"
+    assert db.get_pending_count("-1") == 1
+    db.prune_pending(now - 30)
+    assert db.get_pending_count("-2") == 1
+    assert db.get_connection().execute("SELECT COUNT(*) FROM deliveries").fetchone()[0] == 1
+
+
+def test_seed_feeds_subscribes_existing_channels_once(temp_db):
+    assert db.save_channel("-1", "admin") is True
+    assert db.save_channel("-1", "other") is False
+    db.seed_feeds([("https://a.example/rss", 1.0), ("https://b.example/rss", 2.0)])
+    assert db.get_channel_feeds("-1") == ["https://a.example/rss", "https://b.example/rss"]
+    assert db.unsubscribe("-1", "https://a.example/rss") is True
+    db.seed_feeds([("https://c.example/rss", 1.0)])
+    assert db.get_channel_feeds("-1") == ["https://b.example/rss"]
+    assert db.get_due_feeds(time.time()) == [("https://b.example/rss", 2.0, None, None, 0, None, "closed")]
+    db.save_feed_schedule([("https://b.example/rss", 600.0, time.time() + 300)])
+    assert db.get_due_feeds(time.time()) == []
+    assert db.get_next_feed_poll() > time.time()
+
+
+def test_near_duplicate_is_skipped_only_where_the_story_was_posted(temp_db):
+    now = time.time()
+    title = "Apple releases iOS 18.2 with Genmoji, Image Playground and ChatGPT integration"
+    assert db.enqueue_pending([(
+        "https://a.example/ios", title, "a", now, 1.0,
+        "Apple today released iOS 18.2, the second major update to iOS 18. It brings Genmoji, "
+        "Image Playground and the ChatGPT integration for Siri to iPhone 15 Pro and iPhone 16 owners in the US.",
+    )]) == 1
+    assert db.enqueue_pending([
+        ("https://a.example/ios", title, "a", now, 1.0, ""),
+        ("https://b.example/ios-18-2", title, "b", now, 1.0,
+         "<p>Apple on Wednesday released iOS 18.2, the second major update to iOS 18. It brings Genmoji, "
+         "Image Playground and ChatGPT integration in Siri to iPhone 15 Pro and iPhone 16 owners.</p>"),
+        ("https://b.example/pixel", "Google Pixel 9a leaks in four colours", "b", now, 1.0, ""),
+    ]) == 2
+    assert db.NEAR_DUPLICATES.value() >= 1
+    db.subscribe("-1", ["a", "b"])
+    db.subscribe("-2", ["b"])
+    db.record_deliveries([("-1", "https://a.example/ios")])
+    assert [row[0] for row in db.peek_pending("-1", 5)] == ["https://b.example/pixel"]
+    assert len(db.peek_pending("-2", 5)) == 2
+
+
+def test_original_is_skipped_once_a_later_copy_was_posted(temp_db):
+    now = time.time()
+    title = "Apple releases iOS 18.2 with Genmoji, Image Playground and ChatGPT integration"
+    db.enqueue_pending([
+        ("https://a.example/ios", title, "a", now - 600, 1.0, ""),
+        ("https://b.example/ios-18-2", title, "b", now, 1.0, ""),
+    ])
+    db.subscribe("-1", ["a", "b"])
+    assert db.peek_pending("-1")[0][0] == "https://b.example/ios-18-2"
+    db.record_deliveries([("-1", "https://b.example/ios-18-2")])
+    assert db.peek_pending("-1") == []
+    assert db.get_pending_count("-1") == 0
+
+
+def test_posted_links_are_counted_as_duplicates_at_enqueue(temp_db):
+    db.save_to_feedcache("Title", "Summary", "https://example.com/a", "example.com")
+    before = db.DUPLICATES.value()
+    assert db.enqueue_pending([("https://example.com/a", "A", "src", time.time(), 1.0, "")]) == 0
+    assert db.DUPLICATES.value() == before + 1
+
+
+def test_similar_stories_from_one_source_are_not_duplicates(temp_db):
+    now = time.time()
+    text = (
+        "Apple has seeded a new beta of iOS 18.2 to developers for testing, one week after "
+        "the previous beta, with bug fixes and performance improvements."
+    )
+    db.enqueue_pending([
+        ("https://a.example/beta3", "Apple seeds iOS 18.2 beta 3 to developers", "a", now, 1.0, text),
+        ("https://a.example/beta4", "Apple seeds iOS 18.2 beta 4 to developers", "a", now, 1.0, text),
+    ])
+    db.subscribe("-1", ["a"])
+    db.record_deliveries([("-1", "https://a.example/beta3")])
+    assert [row[0] for row in db.peek_pending("-1")] == ["https://a.example/beta4"]
+
+
+def test_connection_is_reused_per_thread_and_reopened_for_a_new_file(temp_db, tmp_path, monkeypatch):
+    conn = db.get_connection()
+    assert db.get_connection() is conn
+    other = []
+
+    def use_connection():
+        other.append(db.get_connection())
+        db.close_connection()
+
+    thread = threading.Thread(target=use_connection)
+    thread.start()
+    thread.join()
+    assert other[0] is not conn
+    monkeypatch.setattr(db, "DB_FILE", str(tmp_path / "other.db"))
+    reopened = db.get_connection()
+    assert reopened is not conn
+    assert reopened.execute("PRAGMA database_list").fetchone()[2] == db.DB_FILE
+    assert reopened.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
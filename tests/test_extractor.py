@@ -0,0 +1,73 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import extractor
+import llm
+
+PAGE = """<html><head><style>p { color: red }</style></head><body>
+<nav><p>Home / News / Gadgets / Reviews / Deals / Podcasts / Videos</p></nav>
+<article>
+  <h1>Phone launched</h1>
+  <div class="share-bar"><p>Share this story on every social network you know</p></div>
+  <p>The company announced a new phone with a larger battery and a faster chip today.</p>
+  <p>Short caption</p>
+  <p>It goes on sale next week in Europe and the United States for the usual price.</p>
+</article>
+<div id="comments"><p>First! This is the best phone ever made, I am buying two.</p></div>
+<footer><p>Copyright 2025 Example Media. All rights reserved worldwide.</p></footer>
+</body></html>"""
+
+
+def test_extract_text_keeps_article_body_only():
+    text = extractor.extract_text(PAGE)
+    assert text.splitlines() == [
+        "Phone launched",
+        "The company announced a new phone with a larger battery and a faster chip today.",
+        "It goes on sale next week in Europe and the United States for the usual price.",
+    ]
+
+
+def test_trim_to_budget_cuts_at_boundary():
+    text = "First sentence is here. Second sentence is a bit longer than that."
+    assert extractor.trim_to_budget(text, 100) == text
+    assert extractor.trim_to_budget(text, 10) == "First sentence is here."
+
+
+def test_build_prompt_appends_text_without_placeholder():
+    assert llm.build_prompt("Read {url}", "https://a", "Body") == "Read https://a" + llm.ARTICLE_SUFFIX.format(text="Body")
+    assert llm.build_prompt("{url}\n{text}", "https://a", "Body") == "https://a\nBody"
+    assert llm.build_prompt("Read {url}", "https://a", None) == "Read https://a"
+
+
+def test_wrapper_classes_do_not_drop_the_article():
+    body = "<p>The company announced a new phone with a larger battery and a faster chip today.</p>"
+    for page in (
+        f'<html><body class="single-post has-sidebar"><div class="content">{body}</div></body></html>',
+        f'<html><body><article class="post share-enabled">{body}<div class="share">Share this story on every social network</div></article></body></html>',
+        f'<html><body><div class="article-body related-tags">{body}</div><div id="related"><p>Another story you might like to read right now, really.</p></div></body></html>',
+    ):
+        assert extractor.extract_text(page) == "The company announced a new phone with a larger battery and a faster chip today."
+
+
+def test_empty_extraction_is_not_cached(monkeypatch):
+    saved = []
+
+    class Response:
+        raw = type("Raw", (), {"read": lambda self, *args, **kwargs: b"<html><body></body></html>"})()
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def raise_for_status(self):
+            pass
+
+    monkeypatch.setattr(extractor, "get_article", lambda url, min_fetched: None)
+    monkeypatch.setattr(extractor, "save_article", lambda url, text: saved.append(url))
+    monkeypatch.setattr(extractor.session, "get", lambda *args, **kwargs: Response())
+    assert extractor.get_article_text("https://example.com/a") is None
+    assert saved == []
@@ -0,0 +1,107 @@
+import sys
+import time
+from pathlib import Path
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import database as db
+import feeds
+
+RSS = b"""<?xml version="1.0"?><rss version="2.0"><channel><title>Example</title>
+<item><title>Story</title><link>https://example.com/1</link><guid>g1</guid></item>
+</channel></rss>"""
+URL = "https://example.com/rss"
+
+
+class Response:
+    def __init__(self, status_code=200, content=b"", headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(self.status_code)
+
+
+def test_fetch_feed_uses_conditional_get(temp_db, monkeypatch):
+    requests_seen = []
+    responses = [
+        Response(200, RSS, {"ETag": '"v1"', "Last-Modified": "Wed, 11 Dec 2024 18:00:00 GMT"}),
+        Response(304),
+        Response(200, RSS, {"ETag": '"v2"'}),
+    ]
+
+    def get(url, timeout, headers):
+        requests_seen.append(headers)
+        return responses.pop(0)
+
+    monkeypatch.setattr(feeds.requests, "get", get)
+    fetch = feeds.fetch_feed(URL)
+    assert [entry.link for entry in fetch.entries] == ["https://example.com/1"]
+    assert "If-None-Match" not in requests_seen[0]
+    assert db.get_feed_state(URL) is None
+    db.save_feed_states([(URL, *fetch.validators)])
+
+    assert feeds.fetch_feed(URL).entries is None
+    assert requests_seen[1]["If-None-Match"] == '"v1"'
+    assert requests_seen[1]["If-Modified-Since"] == "Wed, 11 Dec 2024 18:00:00 GMT"
+
+    # Same body under a new ETag: recognised by its content hash, not parsed.
+    monkeypatch.setattr(feeds, "new_entries", lambda *args: pytest.fail("unchanged body was parsed"))
+    fetch = feeds.fetch_feed(URL)
+    assert fetch.entries is None and fetch.validators[0] == '"v2"'
+
+
+def test_validators_are_saved_only_after_entries_are_queued(temp_db, monkeypatch):
+    db.save_channel("-1", "admin")
+    db.subscribe("-1", [URL])
+    monkeypatch.setattr(feeds.requests, "get", lambda url, timeout, headers: Response(200, RSS, {"ETag": '"v1"'}))
+
+    enqueue_pending = feeds.enqueue_pending
+
+    def fail(items):
+        raise RuntimeError("database is locked")
+
+    monkeypatch.setattr(feeds, "enqueue_pending", fail)
+    with pytest.raises(RuntimeError):
+        feeds.poll_feeds()
+    assert db.get_feed_state(URL) is None
+
+    monkeypatch.setattr(feeds, "enqueue_pending", enqueue_pending)
+    assert feeds.poll_feeds() == 1
+    assert db.get_feed_state(URL)[:1] == ('"v1"',)
+
+
+def test_fetch_feeds_reports_timeouts_and_errors(monkeypatch):
+    def fetch_feed(url):
+        if url == "slow":
+            time.sleep(0.5)
+        if url == "broken":
+            raise RuntimeError("503 Server Error")
+        return feeds.FeedFetch(entries=[])
+
+    monkeypatch.setattr(feeds, "FETCH_TIMEOUT", 0.1)
+    monkeypatch.setattr(feeds, "fetch_feed", fetch_feed)
+    results = feeds.fetch_feeds(["slow", "broken", "ok"])
+    assert results["slow"].error == "таймаут"
+    assert results["broken"].error == "503 Server Error"
+    assert results["ok"].error is None and results["ok"].entries == []
+
+
+def test_check_feed_rejects_internal_addresses_and_non_feeds(monkeypatch):
+    addresses = {"feeds.example.com": "93.184.216.34", "intranet.example.com": "10.0.0.5"}
+    monkeypatch.setattr(
+        feeds.socket, "getaddrinfo", lambda host, port: [(None, None, None, "", (addresses[host], 0))]
+    )
+    pages = {
+        "https://feeds.example.com/rss": Response(200, RSS),
+        "https://feeds.example.com/page": Response(200, b"<html><body><p>Not a feed</p></body></html>"),
+        "https://feeds.example.com/missing": Response(404),
+    }
+    monkeypatch.setattr(feeds.requests, "get", lambda url, timeout, headers: pages[url])
+    assert feeds.check_feed("https://feeds.example.com/rss") is None
+    assert feeds.check_feed("https://intranet.example.com/rss") == "внутренний адрес"
+    assert feeds.check_feed("https://feeds.example.com/page") == "в ответе нет записей RSS"
+    assert feeds.check_feed("https://feeds.example.com/missing") == "404"
@@ -0,0 +1,57 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from feedstream import high_water_mark, new_entries
+
+RSS = b"""<?xml version="1.0"?><rss version="2.0"><channel><title>Example</title>
+<link>https://example.com/</link>
+<item><title>Third</title><link>https://example.com/3</link><guid>g3</guid>
+<pubDate>Wed, 11 Dec 2024 18:00:00 GMT</pubDate><description><![CDATA[<p>Body 3</p>]]></description></item>
+<item><title>Second</title><link>https://example.com/2</link><guid>g2</guid>
+<pubDate>Wed, 11 Dec 2024 17:00:00 GMT</pubDate></item>
+<item><title>First</title><link>https://example.com/1</link><guid>g1</guid>
+<pubDate>Wed, 11 Dec 2024 16:00:00 GMT</pubDate></item>
+</channel></rss>"""
+
+ATOM = b"""<?xml version="1.0" encoding="utf-8"?><feed xmlns="http://www.w3.org/2005/Atom">
+<title>Example</title><link href="https://example.com/"/>
+<entry><title>New</title><link rel="alternate" href="https://example.com/new"/><id>tag:new</id>
+<published>2024-12-11T18:00:00Z</published><summary>Fresh</summary></entry>
+<entry><title>Old</title><link href="https://example.com/old"/><id>tag:old</id>
+<updated>2024-12-10T18:00:00+00:00</updated></entry>
+</feed>"""
+
+
+def test_rss_stops_at_high_water_mark():
+    entries = new_entries(RSS)
+    assert [e.title for e in entries] == ["Third", "Second", "First"]
+    assert entries[0].summary == "<p>Body 3</p>"
+    guid, published = high_water_mark(entries)
+    assert guid == "g3"
+    assert [e.link for e in new_entries(RSS, "g2", None)] == ["https://example.com/3"]
+    assert new_entries(RSS, guid, published) == []
+
+
+def test_atom_entries_and_published_cutoff():
+    entries = new_entries(ATOM)
+    assert [(e.link, e.id) for e in entries] == [("https://example.com/new", "tag:new"), ("https://example.com/old", "tag:old")]
+    _, published = high_water_mark(entries[:1])
+    assert [e.title for e in new_entries(ATOM, "tag:missing", published)] == ["New"]
+
+
+def test_malformed_xml_falls_back_to_feedparser():
+    broken = RSS.replace(b"<title>Second</title>", b"<title>Second &nbsp; story</title>")
+    entries = new_entries(broken, "g1", None)
+    assert [e.link for e in entries] == ["https://example.com/3", "https://example.com/2"]
+
+
+def test_bumped_older_entry_does_not_hide_new_ones():
+    bumped = RSS.replace(
+        b"<item><title>Third</title>",
+        b"<item><title>Bumped</title><link>https://example.com/0</link><guid>g0</guid>"
+        b"<pubDate>Wed, 11 Dec 2024 12:00:00 GMT</pubDate></item><item><title>Third</title>",
+    )
+    _, published = high_water_mark(new_entries(RSS)[1:])
+    assert [e.title for e in new_entries(bumped, "g2", published)] == ["Third"]
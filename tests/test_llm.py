@@ -0,0 +1,22 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import llm
+
+
+def test_request_errors_are_retried_with_backoff(temp_db, monkeypatch):
+    class Completions:
+        def create(self, **kwargs):
+            raise ConnectionError("connection reset")
+
+    client = type("Client", (), {"chat": type("Chat", (), {"completions": Completions()})()})()
+    sleeps = []
+    monkeypatch.setattr(llm, "get_client", lambda: client)
+    monkeypatch.setattr(llm, "get_article_text", lambda url: None)
+    monkeypatch.setattr(llm, "log_error", lambda message, link: None)
+    monkeypatch.setattr(llm.time, "sleep", sleeps.append)
+    title, _ = llm.get_article_content("https://example.com/a", max_attempts=3)
+    assert title.startswith("Ошибка")
+    assert sleeps == [llm.ERROR_BACKOFF, llm.ERROR_BACKOFF * 2]
@@ -0,0 +1,41 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from metrics import Counter, Histogram, Registry
+
+
+def test_counter_render_and_totals():
+    registry = Registry()
+    posts = registry.register(Counter("posts_total", "Posts.", ["channel"]))
+    posts.inc(channel="@a")
+    posts.inc(2, channel='@b"')
+    assert posts.value(channel="@a") == 1
+    assert posts.value() == 3
+    text = registry.render()
+    assert "# TYPE posts_total counter" in text
+    assert 'posts_total{channel="@a"} 1' in text
+    assert 'posts_total{channel="@b\\""} 2' in text
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    latency = registry.register(Histogram("latency_seconds", "Latency.", buckets=(0.1, 1)))
+    latency.observe(0.05)
+    latency.observe(0.5)
+    latency.observe(5)
+    text = registry.render()
+    assert 'latency_seconds_bucket{le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{le="1"} 2' in text
+    assert 'latency_seconds_bucket{le="+Inf"} 3' in text
+    assert "latency_seconds_count 3" in text
+    assert latency.count() == 3
+
+
+def test_histogram_timer_labels_can_be_set_inside_block():
+    latency = Histogram("op_seconds", "Op.", ["status"])
+    with latency.time(status="error") as labels:
+        labels["status"] = "ok"
+    assert latency.count(status="ok") == 1
+    assert latency.count(status="error") == 0
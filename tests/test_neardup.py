@@ -0,0 +1,33 @@
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from neardup import SimHashIndex, distance, simhash
+
+
+def test_simhash_ignores_markup_and_case():
+    a = simhash("Samsung unveils the Galaxy S25 Ultra with a titanium frame")
+    b = simhash("<p>SAMSUNG unveils the Galaxy S25 Ultra with a titanium frame</p>")
+    assert a == b
+    assert distance(a, simhash("Microsoft patches a Windows zero-day exploited in the wild")) > 3
+
+
+def test_index_finds_close_fingerprints_within_window():
+    index = SimHashIndex(window=60)
+    now = time.time()
+    index.add("old", 0xFFFF, now - 120)
+    index.add("story", 0x0123456789ABCDEF, now)
+    assert index.find(0x0123456789ABCDEF ^ 0b1010101, now) == "story"
+    assert index.find(0x0123456789ABCDEF ^ 0xFF, now) is None
+    assert index.find(0xFFFF, now) is None
+    assert len(index) == 1
+
+
+def test_index_ignores_fingerprints_from_the_same_source():
+    index = SimHashIndex(window=60)
+    now = time.time()
+    index.add("a1", 0x0123456789ABCDEF, now, "a")
+    assert index.find(0x0123456789ABCDEF ^ 0b101, now, "a") is None
+    assert index.find(0x0123456789ABCDEF ^ 0b101, now, "b") == "a1"
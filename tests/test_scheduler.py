@@ -0,0 +1,94 @@
+import sys
+from pathlib import Path
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import database as db
+import feeds
+
+
+@pytest.fixture
+def schedule(temp_db):
+    for channel_id in ("-1", "-2", "-3"):
+        db.save_channel(channel_id, "admin")
+    feeds.load_schedule()
+
+
+def test_only_due_channels_are_popped(schedule):
+    feeds.set_channel_interval("-2", 600)
+    now = feeds.time.time()
+    feeds._reschedule({"-1": 60, "-3": 3600}, {"-1"}, now)
+    assert feeds._pop_due(now + 1) == ["-2"]
+    assert feeds._time_to_next(now) == pytest.approx(60, abs=1)
+    assert feeds._pop_due(now + 61) == ["-1"]
+    assert db.get_schedule("-1")[2] == now
+
+
+def test_rescheduling_supersedes_old_deadline(schedule):
+    now = feeds.time.time()
+    feeds._reschedule({"-1": 60, "-2": 60, "-3": 60}, set(), now)
+    feeds.post_now("-3")
+    assert feeds._pop_due(now + 1) == ["-3"]
+    assert sorted(feeds._pop_due(now + 61)) == ["-1", "-2"]
+    assert feeds._time_to_next(now) is None
+
+
+def test_publish_interval_tracks_feed_rate():
+    now = 100000.0
+    estimate = feeds.estimate_publish_interval(None, None, [now - 1200, now - 600, now], now)
+    assert estimate == pytest.approx(600)
+    busy = feeds.estimate_publish_interval(estimate, now, [now + 60, now + 120], now + 120)
+    assert busy < estimate
+    quiet = feeds.estimate_publish_interval(estimate, now, [], now + 20000)
+    assert quiet > estimate
+    assert feeds.FEED_MIN_POLL * 0.9 <= feeds.next_poll_delay(busy) <= feeds.FEED_MIN_POLL * 1.1
+    assert feeds.next_poll_delay(10 ** 9) <= feeds.FEED_MAX_POLL * 1.1
+
+
+def test_circuit_opens_after_repeated_failures_and_backs_off():
+    now = 100000.0
+    failed = feeds.FeedFetch(error="503", seconds=1.0)
+    failures, latency, circuit, open_until = 0, None, "closed", None
+    for _ in range(feeds.FEED_FAILURE_THRESHOLD - 1):
+        failures, latency, circuit, open_until = feeds.update_health(failures, latency, failed, now)
+    assert (failures, circuit, open_until) == (feeds.FEED_FAILURE_THRESHOLD - 1, "closed", None)
+    failures, latency, circuit, first_open = feeds.update_health(failures, latency, failed, now)
+    assert circuit == "open" and first_open - now >= feeds.FEED_BACKOFF_BASE
+    failures, latency, circuit, second_open = feeds.update_health(failures, latency, failed, now)
+    assert second_open - now >= 2 * feeds.FEED_BACKOFF_BASE
+    assert feeds.update_health(failures, latency, feeds.FeedFetch(entries=[], seconds=0.2), now)[:3:2] == (0, "closed")
+    assert "отключён" in feeds.format_feed_health(
+        [("https://a.example/rss", failures, "503 <Server Error>", latency, circuit, second_open)], now
+    )
+
+
+def test_failed_cycle_reschedules_popped_channels(schedule, monkeypatch):
+    def fail(channel_ids):
+        feeds.posting_active = False
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(feeds, "load_schedule", lambda: None)
+    monkeypatch.setattr(feeds, "run_posting_cycle", fail)
+    monkeypatch.setattr(feeds, "posting_active", True)
+    feeds.post_news()
+    due = feeds._time_to_next(feeds.time.time())
+    assert due == pytest.approx(feeds.ERROR_RETRY_DELAY, abs=2)
+    assert db.get_schedule("-1")[1] > feeds.time.time()
+
+
+def test_lookahead_batch_skips_cached_summaries(schedule, monkeypatch):
+    batches = []
+
+    def summarize(links):
+        batches.append(links)
+        raise RuntimeError("stop")
+
+    items = [(f"https://a.example/{n}", None, "https://a.example/rss") for n in range(4)]
+    monkeypatch.setattr(feeds, "peek_pending", lambda channel_id, limit: items[:limit])
+    monkeypatch.setattr(feeds, "cached_summary", lambda link: ("t", "s") if link.endswith("/1") else None)
+    monkeypatch.setattr(feeds, "summarize_many", summarize)
+    with pytest.raises(RuntimeError):
+        feeds.run_posting_cycle(["-1"])
+    assert "https://a.example/1" not in batches[0]
+    assert batches[0][0] == "https://a.example/0"
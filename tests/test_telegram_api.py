@@ -0,0 +1,75 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import telegram_api as tg
+
+
+def test_permission_cache_and_invalidation(monkeypatch):
+    calls = []
+
+    def fake_fetch(channel_id):
+        calls.append(channel_id)
+        return True
+
+    monkeypatch.setattr(tg, "_fetch_post_rights", fake_fetch)
+    monkeypatch.setattr(tg, "_permissions", {})
+    assert tg.can_post_to_channel("@chan") is True
+    assert tg.can_post_to_channel("@chan") is True
+    assert calls == ["@chan"]
+    tg.invalidate_permission("@chan")
+    assert tg.can_post_to_channel("@chan") is True
+    assert calls == ["@chan", "@chan"]
+
+
+def test_failed_permission_check_is_not_cached(monkeypatch):
+    results = [None, False]
+    monkeypatch.setattr(tg, "_fetch_post_rights", lambda channel_id: results.pop(0))
+    monkeypatch.setattr(tg, "_permissions", {})
+    assert tg.can_post_to_channel("@chan") is False
+    assert tg.can_post_to_channel("@chan") is False
+    assert results == []
+    assert tg._permissions["@chan"][0] is False
+
+
+def test_send_queue_retries_after_429():
+    answers = [(False, 0.01), (True, None)]
+    sent = []
+
+    def sender(payload):
+        sent.append(payload["chat_id"])
+        return answers.pop(0)
+
+    queue = tg.SendQueue(sender, workers=1, global_rate=100, chat_rate=100)
+    results = []
+    future = queue.enqueue({"chat_id": 1, "text": "hi"}, callback=results.append)
+    assert future.result(timeout=2) is True
+    assert sent == [1, 1]
+    assert results == [True]
+
+
+def test_send_queue_gives_up_after_max_retries():
+    queue = tg.SendQueue(lambda payload: (False, 0.0), workers=2, global_rate=100, chat_rate=100, max_retries=2)
+    assert queue.enqueue({"chat_id": 1, "text": "hi"}).result(timeout=2) is False
+
+
+def test_check_channels_reports_each_channel(monkeypatch):
+    rights = {"@ok": True, "@kicked": False, "@unknown": None}
+    monkeypatch.setattr(tg, "_fetch_post_rights", lambda channel_id: rights[channel_id])
+    monkeypatch.setattr(tg, "_permissions", {})
+    assert tg.check_channels(["@ok", "@kicked", "@unknown"]) == {"@ok": True, "@kicked": False, "@unknown": False}
+
+
+def test_send_to_channels_reports_each_channel(monkeypatch):
+    sent = []
+
+    def sender(payload):
+        sent.append(payload["chat_id"])
+        return payload["chat_id"] != "@blocked", None
+
+    monkeypatch.setattr(tg, "TELEGRAM_TOKEN", "token")
+    monkeypatch.setattr(tg, "_send_queue", tg.SendQueue(sender, workers=2, global_rate=100, chat_rate=100))
+    results = tg.send_to_channels(["@a", "@blocked", "@b"], "news")
+    assert results == {"@a": True, "@blocked": False, "@b": True}
+    assert sorted(sent) == ["@a", "@b", "@blocked"]